@@ -1,86 +1,204 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, current_app
+from flask import (
+    Flask,
+    Blueprint,
+    render_template,
+    request,
+    redirect,
+    url_for,
+    flash,
+    current_app,
+    make_response,
+    session,
+)
 from flask_login import (
     LoginManager,
-    UserMixin,
     login_user,
     logout_user,
     current_user,
     login_required,
 )
 from functools import wraps
+from datetime import datetime, timezone
+import click
 from mysqldb import DBConnector
+from cache import PageCache, TTLCache, VersionedCache
+from pagination import AFTER, BEFORE, decode_cursor, encode_cursor, seek_clause
 import mysql.connector as connector
-from users_policy import UsersPolicy
-import markdown
-import bleach
-
-app = Flask(__name__)
-app.config.from_pyfile("config.py")
-db_connector = DBConnector(app)
+import book_stats
+import changes
+from changes import CatalogChanges
+from http_cache import HttpCache
+from markupsafe import Markup
+from rendering import RENDERER_VERSION, render_cache, render_markdown, sanitize
+from passwords import passwords
+from permissions import permissions
+from models import GENRE_SEPARATOR, Book, BookListItem, Genre, Review, User
+
+db_connector = DBConnector()
+catalog_count = VersionedCache("catalog_count")
+user_cache = TTLCache("users")
+genre_cache = VersionedCache("genres")
+# Общая с genre_cache версия: сброс жанров сбрасывает и отрисованные фрагменты
+genre_fragments = TTLCache("genres", maxsize=256)
+book_rows = TTLCache("book_rows", maxsize=4096, ttl=600)
+page_cache = PageCache("pages")
+catalog_changes = CatalogChanges(db_connector)
+http_cache = HttpCache()
 
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "auth"
+login_manager.login_view = "books.auth"
 login_manager.login_message = "Авторизуйтесь для доступа к этой странице"
 login_manager.login_message_category = "warning"
 
+bp = Blueprint("books", __name__)
+
 MAX_PER_PAGE = 3
+NUMBERED_PAGES = 5
+REVIEWS_PER_PAGE = 10
 
+USER_COLUMNS = "user_id, login, role_id, first_name, middle_name, last_name"
+USER_BY_ID = db_connector.statement(
+    "user_by_id", f"SELECT {USER_COLUMNS} FROM users WHERE user_id = %s", User
+)
+# Пароль проверяется в приложении: поиск только по уникальному индексу login
+USER_BY_LOGIN = db_connector.statement(
+    "user_by_login", f"SELECT {USER_COLUMNS}, password FROM users WHERE login = %s"
+)
+REHASH_PASSWORD = db_connector.statement(
+    "rehash_password",
+    "UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+)
+GENRES = db_connector.statement(
+    "genres", "SELECT genre_id, genre_name FROM genres ORDER BY genre_id", Genre
+)
+BOOK_LIST_SQL = f"""
+    SELECT b.book_id, b.book_name, b.year,
+           GROUP_CONCAT(g.genre_name ORDER BY g.genre_name SEPARATOR '{GENRE_SEPARATOR}') AS genres,
+           s.avg_rating, s.review_count
+    FROM (
+        SELECT book_id, book_name, year FROM books {{page_query}}
+    ) b
+    LEFT JOIN book_stats s ON b.book_id = s.book_id
+    LEFT JOIN books_genres bg ON b.book_id = bg.book_id
+    LEFT JOIN genres g ON bg.genre_id = g.genre_id
+    GROUP BY b.book_id, b.book_name, b.year, s.avg_rating, s.review_count
+    ORDER BY b.year DESC, b.book_id DESC
+"""
+BOOK_VIEW = db_connector.statement(
+    "book_view",
+    f"""
+    SELECT b.book_id, b.book_name, b.book_description, b.book_description_html, b.render_version, b.year, b.publishing_house, b.author, b.volume_pages, b.cover_id,
+           GROUP_CONCAT(g.genre_name ORDER BY g.genre_name SEPARATOR '{GENRE_SEPARATOR}') AS genres,
+           s.avg_rating, s.review_count
+    FROM books b
+    LEFT JOIN book_stats s ON b.book_id = s.book_id
+    LEFT JOIN books_genres bg ON b.book_id = bg.book_id
+    LEFT JOIN genres g ON bg.genre_id = g.genre_id
+    WHERE b.book_id = %s
+    GROUP BY b.book_id, s.avg_rating, s.review_count
+""",
+    Book,
+)
+REVIEW_LIST_SQL = """
+    SELECT r.review_id, r.rating, r.text, r.user_id, r.date, u.login AS username
+    FROM reviews r
+    JOIN users u ON r.user_id = u.user_id
+    WHERE r.book_id = %s {condition}
+    ORDER BY {order_by}
+    LIMIT %s
+"""
+USER_REVIEW = db_connector.statement(
+    "user_review",
+    """
+    SELECT review_id, rating, text, user_id FROM reviews
+    WHERE book_id = %s AND user_id = %s
+    LIMIT 1
+""",
+    Review,
+)
+BOOK_VIEW_CALL = db_connector.statement(
+    "book_view_call", "CALL book_view(%s, %s, %s)", (Book, Review, Review)
+)
+INSERT_REVIEW = db_connector.statement(
+    "insert_review",
+    """
+    INSERT INTO reviews (book_id, user_id, rating, text)
+    VALUES (%s, %s, %s, %s)
+""",
+)
+UPDATE_BOOK = db_connector.statement(
+    "update_book",
+    """
+    UPDATE books
+    SET book_name = %s, book_description = %s, year = %s, publishing_house = %s,
+        author = %s, volume_pages = %s, book_description_html = %s, render_version = %s
+    WHERE book_id = %s
+""",
+)
 
-@login_manager.user_loader
-def load_user(user_id):
-    with db_connector.connect().cursor(named_tuple=True) as cursor:
-        cursor.execute("SELECT * FROM users WHERE user_id = %s;", (user_id,))
-        users = cursor.fetchone()
-    if users is not None:
-        return User(
-            user_id=users.user_id,
-            user_login=users.login,
-            role_id=users.role_id,
-            first_name=users.first_name,
-            middle_name=users.middle_name,
-            last_name=users.last_name,
-        )
-    return None
 
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_pyfile("config.py")
+    if config is not None:
+        app.config.from_mapping(config)
+    app.logger.setLevel(app.config.get("LOG_LEVEL", "INFO"))
+    db_connector.init_app(app)
+    catalog_count.init_app(app)
+    user_cache.init_app(
+        app,
+        maxsize=app.config.get("USER_CACHE_SIZE"),
+        ttl=app.config.get("USER_CACHE_TTL"),
+    )
+    genre_cache.init_app(app, ttl=app.config.get("GENRE_CACHE_TTL"))
+    genre_fragments.init_app(app, ttl=app.config.get("GENRE_CACHE_TTL"))
+    book_rows.init_app(
+        app,
+        maxsize=app.config.get("BOOK_ROW_CACHE_SIZE"),
+        ttl=app.config.get("BOOK_ROW_CACHE_TTL"),
+    )
+    render_cache.init_app(app)
+    db_connector.add_summary(render_cache.summary)
+    catalog_changes.init_app(app)
+    permissions.init_app(app, db_connector)
+    passwords.init_app(app)
+    # Изменение ролей в другом процессе (команда reload-permissions)
+    catalog_changes.listen(changes.ROLES, permissions.reload)
+    for kind in changes.KINDS:
+        catalog_changes.listen(kind, purge_changed, each_server=True)
+    http_cache.init_app(app)
+    page_cache.init_app(
+        app,
+        maxsize=app.config.get("PAGE_CACHE_SIZE"),
+        ttl=app.config.get("PAGE_CACHE_TTL"),
+        stale=app.config.get("PAGE_CACHE_STALE"),
+    )
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    return app
 
-class User(UserMixin):
-    def __init__(
-        self, user_id, user_login, role_id, first_name, middle_name, last_name
-    ):
-        self.id = user_id
-        self.user_login = user_login
-        self.role_id = role_id
-        self.first_name = first_name
-        self.middle_name = middle_name
-        self.last_name = last_name
 
-    def is_admin(self):
-        return self.role_id == current_app.config["ADMIN_ROLE_ID"]
+@login_manager.user_loader
+def load_user(user_id):
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    return user_cache.get(user_id, fetch_user)
 
-    def is_moder(self):
-        return self.role_id == current_app.config["MODER_ROLE_ID"]
 
-    def can(self, action, user=None):
-        policy = UsersPolicy(user)
-        return getattr(policy, action, lambda: False)()
+def fetch_user(user_id):
+    return next(iter(db_connector.query(USER_BY_ID, (user_id,))), None)
 
 
 def check_for_privilege(action):
     def decorator(function):
         @wraps(function)
         def wrapper(*args, **kwargs):
-            user = None
-            if "user_id" in kwargs.keys():
-                with db_connector.connect().cursor(named_tuple=True) as cursor:
-                    cursor.execute(
-                        "SELECT * FROM users WHERE user_id = %s;",
-                        (kwargs.get("user_id"),),
-                    )
-                    user = cursor.fetchone()
-            if not current_user.can(action, user):
+            role_id = current_user.role_id if current_user.is_authenticated else None
+            if not permissions.allowed(role_id, action):
                 flash("Недостаточно прав для доступа к этой странице", "warning")
-                return redirect(url_for("index"))
+                return redirect(url_for("books.index"))
             return function(*args, **kwargs)
 
         return wrapper
@@ -88,97 +206,250 @@ def check_for_privilege(action):
     return decorator
 
 
-@app.route("/auth", methods=["POST", "GET"])
+def cached_page(versions):
+    # Страница целиком кэшируется только для анонимных GET-запросов без
+    # ожидающих flash-сообщений; versions(**аргументы маршрута) — версии
+    # данных страницы по журналу изменений каталога
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if (
+                not page_cache.enabled
+                or request.method != "GET"
+                or current_user.is_authenticated
+                or "_flashes" in session
+            ):
+                return function(*args, **kwargs)
+            key = request.full_path
+            page_versions = versions(**kwargs)
+            cached = page_cache.lookup(key, page_versions)
+            if cached is not None:
+                body, status, headers = cached
+                return current_app.response_class(body, status, headers)
+            response = make_response(function(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                page_cache.save(
+                    key,
+                    page_versions,
+                    (response.get_data(), response.status_code, list(response.headers)),
+                )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def conditional(versions, modified):
+    # ETag из версий данных страницы и пользователя, Last-Modified — только
+    # анонимам (страница зависит от пользователя, а дата этого не отражает).
+    # Актуальная копия у клиента подтверждается 304 до запросов к БД.
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if "_flashes" in session:
+                return function(*args, **kwargs)
+            etag = page_etag(versions(**kwargs))
+            last_modified = None
+            if not current_user.is_authenticated:
+                timestamp = modified(**kwargs)
+                if timestamp is not None:
+                    last_modified = datetime.fromtimestamp(int(timestamp), timezone.utc)
+            if is_not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(function(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def page_etag(versions):
+    user = "anon"
+    if current_user.is_authenticated:
+        user = f"u{current_user.id}r{current_user.role_id}"
+    parts = [current_app.config.get("TEMPLATES_VERSION", 1), *versions, user]
+    return "-".join(str(part) for part in parts)
+
+
+def is_not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def catalog_versions():
+    return (catalog_changes.catalog_version,)
+
+
+def catalog_modified():
+    return catalog_changes.catalog_modified
+
+
+def book_versions(book_id):
+    return (catalog_changes.book_version(book_id),)
+
+
+def book_modified(book_id):
+    return catalog_changes.book_modified(book_id)
+
+
+def catalog_keys():
+    return ["catalog"]
+
+
+def book_keys(book_id):
+    return [f"book-{book_id}", "books"]
+
+
+def catalog_changed():
+    # После фиксации записи: свежие версии в этом воркере; прокси очищает
+    # purge_changed, когда опрос применит изменение
+    catalog_changes.poll()
+
+
+def purge_changed(applied):
+    # Вызывается опросом каждого сервера в каждом воркере: страницу, которую
+    # прокси запросит заново, воркер отрисует уже с этим изменением
+    keys = {
+        "books" if book_id is None else f"book-{book_id}"
+        for _, _, book_id, _ in applied
+    }
+    http_cache.purge("catalog", *sorted(keys))
+
+
+@bp.route("/auth", methods=["POST", "GET"])
 def auth():
     error = ""
     if request.method == "POST":
         login = request.form["username"]
         password = request.form["password"]
         remember_me = request.form.get("remember_me", None) == "on"
-        with db_connector.connect().cursor(named_tuple=True, buffered=True) as cursor:
-            cursor.execute(
-                "SELECT * FROM users WHERE login = %s AND password = SHA2(%s, 256)",
-                (login, password),
-            )
-            users = cursor.fetchone()
-        if users is not None:
+        user = authenticate(login, password)
+        if user is not None:
             flash("Авторизация прошла успешно", "success")
-            login_user(
-                User(
-                    user_id=users.user_id,
-                    user_login=users.login,
-                    role_id=users.role_id,
-                    first_name=users.first_name,
-                    middle_name=users.middle_name,
-                    last_name=users.last_name,
-                ),
-                remember=remember_me,
-            )
-            next_url = request.args.get("next", url_for("index"))
+            login_user(user, remember=remember_me)
+            next_url = request.args.get("next", url_for("books.index"))
             return redirect(next_url)
         flash("Невозможно аутентифицироваться с указанными логином и паролем", "danger")
     return render_template("auth.html")
 
 
-@app.route("/")
+def authenticate(login, password):
+    row = next(iter(db_connector.query(USER_BY_LOGIN, (login,))), None)
+    if row is None:
+        passwords.dummy_verify(password)
+        return None
+    valid, rehash = passwords.verify(password, row.password)
+    if not valid:
+        return None
+    if rehash:
+        # Условие на прежний хэш: не затереть пароль, сменённый параллельно
+        with db_connector.transaction():
+            db_connector.execute(
+                REHASH_PASSWORD, (passwords.hash(password), row.user_id, row.password)
+            )
+    return User(*row[:-1])
+
+
+@bp.route("/")
+@http_cache.policy(catalog_keys)
+@conditional(catalog_versions, catalog_modified)
+@cached_page(catalog_versions)
 def index():
-    page = request.args.get("page", 1, type=int)
-    books = []
-    with db_connector.connect().cursor(named_tuple=True) as cursor:
-        cursor.execute(
-            """
-            SELECT b.book_id, b.book_name, b.year, 
-                   GROUP_CONCAT(DISTINCT g.genre_name ORDER BY g.genre_name SEPARATOR ', ') AS genres,
-                   AVG(r.rating) AS avg_rating,
-                   (SELECT COUNT(*) FROM reviews WHERE book_id = b.book_id) AS review_count
-            FROM books b
-            LEFT JOIN books_genres bg ON b.book_id = bg.book_id
-            LEFT JOIN genres g ON bg.genre_id = g.genre_id
-            LEFT JOIN reviews r ON b.book_id = r.book_id
-            GROUP BY b.book_id, b.book_name, b.year
-            ORDER BY b.year DESC
-            LIMIT %s OFFSET %s
-        """,
-            (MAX_PER_PAGE, (page - 1) * MAX_PER_PAGE),
-        )
-        books = cursor.fetchall()
+    page = min(max(1, request.args.get("page", 1, type=int)), NUMBERED_PAGES)
+    seek = decode_cursor("books", request.args.get("cursor", ""))
+    if seek is not None:
+        page = seek["page"]
+        condition, order_by, params = seek_clause(("year", "book_id"), seek)
+        page_query = f"WHERE {condition} ORDER BY {order_by}"
+        name = f"book_list_{seek['direction']}"
+        offset = 0
+    else:
+        page_query, params = "ORDER BY year DESC, book_id DESC", ()
+        name = "book_list"
+        offset = (page - 1) * MAX_PER_PAGE
+    page_query += " LIMIT %s OFFSET %s"
+    params += (MAX_PER_PAGE, offset)
+
+    statement = db_connector.statement(
+        name, BOOK_LIST_SQL.format(page_query=page_query), BookListItem
+    )
+    books = db_connector.query(statement, params)
 
-        cursor.execute("SELECT COUNT(*) AS count FROM books")
-        record_count = cursor.fetchone().count
+    with db_connector.connect().cursor(named_tuple=True) as cursor:
+        record_count = catalog_count.get(lambda: count_books(cursor))
         page_count = (record_count // MAX_PER_PAGE) + (
             1 if record_count % MAX_PER_PAGE > 0 else 0
         )
-        pages = range(max(1, page - 3), min(page_count, page + 3) + 1)
+        pages = range(1, min(page_count, NUMBERED_PAGES) + 1)
+
+    prev_cursor = next_cursor = None
+    if books and page > 1:
+        prev_cursor = encode_cursor(
+            "books", (books[0].year, books[0].book_id), BEFORE, page - 1
+        )
+    if books and page < page_count:
+        next_cursor = encode_cursor(
+            "books", (books[-1].year, books[-1].book_id), AFTER, page + 1
+        )
 
     return render_template(
-        "index.html", books=books, page=page, pages=pages, page_count=page_count
+        "index.html",
+        books=books,
+        page=page,
+        pages=pages,
+        page_count=page_count,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
     )
 
 
-if __name__ == "__main__":
-    app.run()
+def count_books(cursor):
+    threshold = current_app.config.get("APPROX_COUNT_THRESHOLD")
+    if threshold:
+        cursor.execute(
+            """
+            SELECT TABLE_ROWS AS count FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'books'
+        """
+        )
+        row = cursor.fetchone()
+        if row is not None and row.count is not None and row.count >= threshold:
+            return row.count
+    cursor.execute("SELECT COUNT(*) AS count FROM books")
+    return cursor.fetchone().count
 
 
-@app.route("/<int:book_id>/delete", methods=["POST"])
+@bp.route("/<int:book_id>/delete", methods=["POST"])
 @login_required
 @check_for_privilege("delete")
 def delete_book(book_id):
-    connection = db_connector.connect()
+    def work(cursor):
+        query = "DELETE FROM books WHERE book_id = %s"
+        cursor.execute(query, (book_id,))
+        catalog_changes.record(cursor, changes.BOOK, book_id)
+
     try:
-        with connection.cursor(named_tuple=True) as cursor:
-            query = "DELETE FROM books WHERE book_id = %s"
-            cursor.execute(query, (book_id,))
-            connection.commit()
+        db_connector.run_in_transaction(work, lock=("books", "book_id", [book_id]))
+        catalog_count.invalidate()
+        catalog_changed()
         flash("Книга успешно удалена", "success")
     except connector.errors.DatabaseError as error:
         flash(f"Ошибка удаления книги: {error}", "danger")
-        connection.rollback()
-    finally:
-        connection.close()
-    return redirect(url_for("index"))
+    return redirect(url_for("books.index"))
 
 
-@app.route("/new", methods=["POST", "GET"])
+@bp.route("/new", methods=["POST", "GET"])
 @login_required
 @check_for_privilege("create")
 def new():
@@ -206,10 +477,11 @@ def new():
             "volume_pages": request.form["volume_pages"],
             "cover_id": request.form["cover_id"],
         }
-        genre_ids = request.form.getlist("genre_ids")
-        if isinstance(book_data, tuple):
-            book_data = book_data._asdict()
-        book_data["book_description"] = markdown.markdown(book_data["book_description"])
+        genre_ids = parse_genre_ids(request.form.getlist("genre_ids"))
+        book_data["book_description_html"] = render_markdown(
+            book_data["book_description"]
+        )
+        book_data["render_version"] = RENDERER_VERSION
 
         if not genre_ids:
             errors["genres"] = "Необходимо выбрать хотя бы один жанр"
@@ -222,28 +494,25 @@ def new():
             errors["year"] = "Введите допустимый год (от 1901 до 2155)"
 
         if not errors:
+
+            def work(cursor):
+                query = """
+                    INSERT INTO books (book_name, book_description, book_description_html, render_version, year, publishing_house, author, volume_pages, cover_id) 
+                    VALUES (%(book_name)s, %(book_description)s, %(book_description_html)s, %(render_version)s, %(year)s, %(publishing_house)s, %(author)s, %(volume_pages)s, %(cover_id)s)
+                """
+                cursor.execute(query, book_data)
+                book_id = cursor.lastrowid
+                add_book_genres(cursor, book_id, genre_ids)
+                catalog_changes.record(cursor, changes.BOOK, book_id)
+
             try:
-                connection = db_connector.connect()
-                with connection.cursor(named_tuple=True) as cursor:
-                    query = """
-                        INSERT INTO books (book_name, book_description, year, publishing_house, author, volume_pages, cover_id) 
-                        VALUES (%(book_name)s, %(book_description)s, %(year)s, %(publishing_house)s, %(author)s, %(volume_pages)s, %(cover_id)s)
-                    """
-                    cursor.execute(query, book_data)
-                    book_id = cursor.lastrowid
-                    for genre_id in genre_ids:
-                        cursor.execute(
-                            "INSERT INTO books_genres (book_id, genre_id) VALUES (%s, %s)",
-                            (book_id, genre_id),
-                        )
-                    connection.commit()
+                db_connector.run_in_transaction(work)
+                catalog_count.invalidate()
+                catalog_changed()
                 flash("Книга успешно создана", "success")
-                return redirect(url_for("index"))
+                return redirect(url_for("books.index"))
             except connector.errors.DatabaseError as error:
                 flash(f"Ошибка создания книги: {error}", "danger")
-                connection.rollback()
-            finally:
-                connection.close()
 
     return render_template(
         "new.html",
@@ -254,113 +523,138 @@ def new():
     )
 
 
-@app.route("/<int:book_id>/view")
+@bp.route("/<int:book_id>/view")
+@http_cache.policy(book_keys)
+@conditional(book_versions, book_modified)
+@cached_page(book_versions)
 def view(book_id):
-    book_data = {}
-    user_review = None
-
-    with db_connector.connect().cursor(named_tuple=True, buffered=True) as cursor:
-        query = """
-            SELECT b.book_id, b.book_name, b.book_description, b.year, b.publishing_house, b.author, b.volume_pages, b.cover_id, GROUP_CONCAT(g.genre_name) AS genres 
-            FROM books b 
-            LEFT JOIN books_genres bg ON b.book_id = bg.book_id 
-            LEFT JOIN genres g ON bg.genre_id = g.genre_id 
-            WHERE b.book_id = %s
-            GROUP BY b.book_id
-        """
-        cursor.execute(query, [book_id])
-        book_data = cursor.fetchone()
-        if book_data is None:
-            flash("Книга не найдена", "danger")
-            return redirect(url_for("index"))
-        print(book_data.book_description)
-        if isinstance(book_data, tuple):
-            book_data = book_data._asdict()
-        book_data["book_description"] = markdown.markdown(book_data["book_description"])
-        query = """
-            SELECT g.genre_name
-            FROM books_genres bg
-            JOIN genres g ON bg.genre_id = g.genre_id
-            WHERE bg.book_id = %s
-        """
-        cursor.execute(query, [book_id])
-        genres = cursor.fetchall()
-
-        query = """
-            SELECT r.review_id, r.rating, r.text, r.user_id, u.login AS username
-            FROM reviews r
-            JOIN users u ON r.user_id = u.user_id
-            WHERE r.book_id = %s
-        """
-        cursor.execute(query, (book_id,))
-        reviews = cursor.fetchall()
-
-        if current_user.is_authenticated:
-            for review in reviews:
-                if isinstance(review, tuple):
-                    review = review._asdict()
-                review["text"] = markdown.markdown(review["text"])
-                if review["user_id"] == current_user.id:
-                    user_review = review
-                    break
+    user_id = current_user.id if current_user.is_authenticated else None
+    seek = decode_cursor("reviews", request.args.get("reviews", ""))
+    page = 1
+    if seek is None:
+        book_data, reviews, user_review = load_book_view(book_id, user_id)
+    else:
+        page = seek["page"]
+        book_data, reviews, user_review = load_book_view_page(book_id, user_id, seek)
+    if book_data is None:
+        flash("Книга не найдена", "danger")
+        return redirect(url_for("books.index"))
+    if book_data.render_version != RENDERER_VERSION:
+        book_data.book_description_html = render_markdown(book_data.book_description)
+
+    has_more = len(reviews) > REVIEWS_PER_PAGE
+    reviews = reviews[:REVIEWS_PER_PAGE]
+    if seek is not None and seek["direction"] == BEFORE:
+        reviews.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = page > 1, has_more
+    if user_review is not None:
+        user_review.text = render_markdown(user_review.text)
+
+    prev_reviews = next_reviews = None
+    if reviews and has_prev:
+        prev_reviews = encode_cursor(
+            "reviews", (str(reviews[0].date), reviews[0].review_id), BEFORE, page - 1
+        )
+    if reviews and has_next:
+        next_reviews = encode_cursor(
+            "reviews", (str(reviews[-1].date), reviews[-1].review_id), AFTER, page + 1
+        )
 
     return render_template(
         "view.html",
         book_data=book_data,
-        genres=genres,
         reviews=reviews,
         user_review=user_review,
+        prev_reviews=prev_reviews,
+        next_reviews=next_reviews,
+    )
+
+
+def load_book_view(book_id, user_id):
+    # Первая страница книги — один CALL вместо трёх запросов
+    books, reviews, user_reviews = db_connector.query_sets(
+        BOOK_VIEW_CALL, (book_id, user_id, REVIEWS_PER_PAGE + 1)
+    )
+    return next(iter(books), None), reviews, next(iter(user_reviews), None)
+
+
+def load_book_view_page(book_id, user_id, seek):
+    book_data = next(iter(db_connector.query(BOOK_VIEW, (book_id,))), None)
+    if book_data is None:
+        return None, [], None
+    condition, order_by, params = seek_clause(("r.date", "r.review_id"), seek)
+    statement = db_connector.statement(
+        f"review_list_{seek['direction']}",
+        REVIEW_LIST_SQL.format(condition=f"AND {condition}", order_by=order_by),
+        Review,
     )
+    reviews = db_connector.query(statement, (book_id, *params, REVIEWS_PER_PAGE + 1))
+    user_review = None
+    if user_id is not None:
+        user_review = next(
+            iter(db_connector.query(USER_REVIEW, (book_id, user_id))), None
+        )
+    return book_data, reviews, user_review
 
 
-@app.route("/<int:book_id>/write_review", methods=["GET", "POST"])
+@bp.route("/<int:book_id>/write_review", methods=["GET", "POST"])
 @login_required
 def write_review(book_id):
 
     if request.method == "POST":
-        rating = request.form["rating"]
+        rating = request.form.get("rating", type=int)
         text = request.form["textrec"]
-        text = markdown.markdown(text)
+        text = render_markdown(text)
+        if rating not in book_stats.RATINGS:
+            flash("Недопустимая оценка", "danger")
+            return render_template("write_review.html", book_id=book_id)
+
+        def work(cursor):
+            db_connector.execute(
+                INSERT_REVIEW, (book_id, current_user.id, rating, text)
+            )
+            book_stats.add_review(cursor, book_id, rating)
+            catalog_changes.record(cursor, changes.REVIEW, book_id)
+
         try:
-            connection = db_connector.connect()
-            with connection.cursor(named_tuple=True) as cursor:
-                query = """
-                    INSERT INTO reviews (book_id, user_id, rating, text) 
-                    VALUES (%s, %s, %s, %s)
-                """
-                cursor.execute(query, (book_id, current_user.id, rating, text))
-                connection.commit()
+            db_connector.run_in_transaction(work, lock=("books", "book_id", [book_id]))
+            catalog_changed()
             flash("Рецензия успешно добавлена", "success")
-            return redirect(url_for("view", book_id=book_id))
+            return redirect(url_for("books.view", book_id=book_id))
         except connector.errors.DatabaseError as error:
             flash(f"Ошибка добавления рецензии: {error}", "danger")
-            connection.rollback()
-        finally:
-            connection.close()
 
     return render_template("write_review.html", book_id=book_id)
 
 
-@app.route("/<int:book_id>/<int:review_id>/delete_review", methods=["POST"])
+@bp.route("/<int:book_id>/<int:review_id>/delete_review", methods=["POST"])
 @login_required
 @check_for_privilege("delete_review")
 def delete_review(book_id, review_id):
-    connection = db_connector.connect()
-    try:
-        with connection.cursor(named_tuple=True) as cursor:
+    def work(cursor):
+        cursor.execute(
+            "SELECT book_id, rating FROM reviews WHERE review_id = %s AND book_id = %s FOR UPDATE",
+            (review_id, book_id),
+        )
+        review = cursor.fetchone()
+        if review is not None:
             query = "DELETE FROM reviews WHERE review_id = %s"
             cursor.execute(query, (review_id,))
-            connection.commit()
+            book_stats.remove_review(cursor, review.book_id, review.rating)
+            catalog_changes.record(cursor, changes.REVIEW, book_id)
+
+    try:
+        db_connector.run_in_transaction(work, lock=("books", "book_id", [book_id]))
+        catalog_changed()
         flash("Рецензия успешно удалена", "success")
     except connector.errors.DatabaseError as error:
         flash(f"Ошибка удаления рецензии: {error}", "danger")
-        connection.rollback()
-    finally:
-        connection.close()
-    return redirect(url_for("view", book_id=book_id))
+    return redirect(url_for("books.view", book_id=book_id))
 
 
-@app.route("/<int:book_id>/edit", methods=["POST", "GET"])
+@bp.route("/<int:book_id>/edit", methods=["POST", "GET"])
 @login_required
 @check_for_privilege("update")
 def edit(book_id):
@@ -375,7 +669,7 @@ def edit(book_id):
         book_data = cursor.fetchone()
         if book_data is None:
             flash("Книга не найдена", "danger")
-            return redirect(url_for("index"))
+            return redirect(url_for("books.index"))
 
         cursor.execute(
             "SELECT genre_id FROM books_genres WHERE book_id = %s", [book_id]
@@ -400,37 +694,48 @@ def edit(book_id):
             "author": request.form["author"],
             "volume_pages": request.form["volume_pages"],
         }
-        book_data["id"] = book_id
-        genre_ids = request.form.getlist("genre_ids")
+        book_data["book_description_html"] = render_markdown(
+            book_data["book_description"]
+        )
+        book_data["render_version"] = RENDERER_VERSION
+        genre_ids = parse_genre_ids(request.form.getlist("genre_ids"))
 
         if not genre_ids:
             errors["genres"] = "Необходимо выбрать хотя бы один жанр"
 
-        try:
-            connection = db_connector.connect()
-            with connection.cursor(named_tuple=True) as cursor:
-                field_assignments = ", ".join(
-                    [
-                        f"{field} = %({field})s"
-                        for field in book_data.keys()
-                        if field != "id"
-                    ]
-                )
-                query = f"UPDATE books SET {field_assignments} WHERE book_id = %(id)s"
-                cursor.execute(query, book_data)
+        def work(cursor):
+            db_connector.execute(
+                UPDATE_BOOK,
+                (
+                    book_data["book_name"],
+                    book_data["book_description"],
+                    book_data["year"],
+                    book_data["publishing_house"],
+                    book_data["author"],
+                    book_data["volume_pages"],
+                    book_data["book_description_html"],
+                    book_data["render_version"],
+                    book_id,
+                ),
+            )
+
+            # Связи перечитываются под блокировкой книги: параллельное
+            # сохранение могло изменить их после загрузки формы
+            cursor.execute(
+                "SELECT genre_id FROM books_genres WHERE book_id = %s", [book_id]
+            )
+            current_genres = {row.genre_id for row in cursor.fetchall()}
+            remove_book_genres(cursor, book_id, current_genres - genre_ids)
+            add_book_genres(cursor, book_id, genre_ids - current_genres)
+            catalog_changes.record(cursor, changes.BOOK, book_id)
 
-                cursor.execute("DELETE FROM books_genres WHERE book_id = %s", [book_id])
-                for genre_id in genre_ids:
-                    cursor.execute(
-                        "INSERT INTO books_genres (book_id, genre_id) VALUES (%s, %s)",
-                        (book_id, genre_id),
-                    )
-                connection.commit()
+        try:
+            db_connector.run_in_transaction(work, lock=("books", "book_id", [book_id]))
+            catalog_changed()
             flash("Книга успешно изменена", "success")
-            return redirect(url_for("index"))
+            return redirect(url_for("books.index"))
         except connector.errors.DatabaseError as error:
             flash(f"Произошла ошибка при изменении записи: {error}", "danger")
-            connection.rollback()
 
     return render_template(
         "edit.html",
@@ -441,26 +746,199 @@ def edit(book_id):
     )
 
 
+def parse_genre_ids(values):
+    return {int(value) for value in values if value.isdigit()}
+
+
+def add_book_genres(cursor, book_id, genre_ids):
+    if genre_ids:
+        cursor.executemany(
+            "INSERT INTO books_genres (book_id, genre_id) VALUES (%s, %s)",
+            [(book_id, genre_id) for genre_id in sorted(genre_ids)],
+        )
+
+
+def remove_book_genres(cursor, book_id, genre_ids):
+    if genre_ids:
+        placeholders = ", ".join(["%s"] * len(genre_ids))
+        cursor.execute(
+            f"DELETE FROM books_genres WHERE book_id = %s AND genre_id IN ({placeholders})",
+            (book_id, *sorted(genre_ids)),
+        )
+
+
 def get_genres():
-    with db_connector.connect().cursor(named_tuple=True) as cursor:
-        cursor.execute("SELECT genre_id, genre_name FROM genres")
-        return cursor.fetchall()
+    return genre_cache.get(fetch_genres)
+
+
+def fetch_genres():
+    return tuple(db_connector.query(GENRES))
+
+
+def invalidate_genres():
+    with db_connector.transaction() as cursor:
+        catalog_changes.record(cursor, changes.GENRES)
+    genre_cache.invalidate()
+    http_cache.purge("catalog", "books")
+
+
+@bp.app_template_global()
+def cached_genre_checkboxes(all_genres, selected_genres, invalid=False):
+    # Названия жанров в ключ не входят: их изменение сбрасывает версию "genres"
+    key = (
+        tuple(genre.genre_id for genre in all_genres),
+        tuple(sorted(selected_genres or ())),
+        bool(invalid),
+    )
+    return genre_fragments.get(
+        key,
+        lambda key: render_genre_checkboxes(all_genres, selected_genres, invalid),
+    )
 
 
-@app.template_filter("markdown")
-def render_markdown(content):
-    return markdown(content)
+def render_genre_checkboxes(all_genres, selected_genres, invalid):
+    macros = current_app.jinja_env.get_template("books_macros.html").module
+    return Markup(macros.genre_checkboxes(all_genres, selected_genres, invalid))
 
 
-@app.route("/logout")
+def role_key():
+    # Права в UsersPolicy зависят только от роли, поэтому строки списка
+    # отрисовываются по одной на роль, а не на пользователя
+    if not current_user.is_authenticated:
+        return "anon"
+    return current_user.role_id
+
+
+@bp.app_template_global()
+def cached_book_row(book):
+    # Версия книги снята в before_request до чтения данных, поэтому строка
+    # не попадёт в кэш под версией новее, чем данные в ней
+    key = (
+        book.book_id,
+        catalog_changes.book_version(book.book_id),
+        role_key(),
+        current_app.config.get("TEMPLATES_VERSION", 1),
+    )
+    return book_rows.get(key, lambda key: render_book_row(book))
+
+
+def render_book_row(book):
+    macros = current_app.jinja_env.get_template("books_macros.html").module
+    can_update = current_user.is_authenticated and current_user.can("update")
+    can_delete = current_user.is_authenticated and current_user.can("delete")
+    return Markup(macros.book_row(book, can_update, can_delete))
+
+
+@bp.app_template_filter("markdown")
+def markdown_filter(content):
+    return Markup(render_markdown(content))
+
+
+@bp.cli.command("backfill-stats")
+def backfill_stats():
+    with db_connector.transaction() as cursor:
+        book_stats.backfill(cursor)
+        catalog_changes.record(cursor, changes.CATALOG)
+    http_cache.purge("catalog", "books")
+    print("Статистика рецензий пересчитана")
+
+
+@bp.cli.command("rerender-descriptions")
+def rerender_descriptions():
+    last_id = 0
+    rendered = 0
+    while True:
+        with db_connector.transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT book_id, book_description FROM books
+                WHERE book_id > %s AND render_version <> %s
+                ORDER BY book_id
+                LIMIT 100
+            """,
+                (last_id, RENDERER_VERSION),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                cursor.execute(
+                    "UPDATE books SET book_description_html = %s, render_version = %s WHERE book_id = %s",
+                    (render_markdown(row.book_description), RENDERER_VERSION, row.book_id),
+                )
+                catalog_changes.record(cursor, changes.BOOK, row.book_id)
+        last_id = rows[-1].book_id
+        rendered += len(rows)
+    http_cache.purge("catalog", "books")
+    print(f"Переотрисовано описаний: {rendered}")
+
+
+@bp.cli.command("invalidate-genres")
+def invalidate_genres_command():
+    invalidate_genres()
+    print("Кэш жанров сброшен")
+
+
+@bp.cli.command("compact-changes")
+def compact_changes():
+    # Для каждой книги достаточно последнего изменения: версии книг
+    # и каталога от удаления предыдущих строк не меняются
+    with db_connector.transaction() as cursor:
+        cursor.execute(
+            """
+            DELETE c FROM catalog_changes c
+            JOIN (
+                SELECT book_id, MAX(version) AS version
+                FROM catalog_changes
+                GROUP BY book_id
+            ) latest ON c.book_id <=> latest.book_id AND c.version < latest.version
+            WHERE c.changed_at < NOW() - INTERVAL 1 HOUR
+        """
+        )
+        deleted = cursor.rowcount
+    print(f"Удалено записей журнала: {deleted}")
+
+
+@bp.cli.command("set-role")
+@click.argument("login")
+@click.argument("role_id", type=int)
+def set_role(login, role_id):
+    with db_connector.transaction() as cursor:
+        cursor.execute(
+            "UPDATE users SET role_id = %s WHERE login = %s", (role_id, login)
+        )
+        updated = cursor.rowcount
+    user_cache.invalidate()
+    print(f"Обновлено пользователей: {updated}")
+
+
+@bp.cli.command("reload-permissions")
+def reload_permissions():
+    # Воркеры перестраивают матрицу, увидев изменение в журнале; оно же
+    # сбрасывает версии книг, а с ними строки списка, отрисованные по ролям
+    with db_connector.transaction() as cursor:
+        catalog_changes.record(cursor, changes.ROLES)
+    http_cache.purge("catalog", "books")
+    for role_id in permissions.load():
+        print(f"{role_id or 'аноним'}: {', '.join(permissions.actions(role_id)) or '-'}")
+
+
+@bp.route("/logout")
 def logout():
     logout_user()
-    return redirect(url_for("index"))
+    return redirect(url_for("books.index"))
 
 
 def clean_content(content):
-    cleaned_content = bleach.clean(content)
+    cleaned_content = sanitize(content)
     if content != cleaned_content:
         flash("Попытка ввод вредоностного элемента. Действие отменено", category="danger")
         return None
     return cleaned_content
+
+
+# Команды замеров и диагностики регистрируются в bp.cli при импорте
+import bench  # noqa: E402,F401
+
+if __name__ == "__main__":
+    create_app().run()
@@ -0,0 +1,207 @@
+import time
+
+import click
+from flask import current_app
+
+from app import BOOK_LIST_SQL, BOOK_VIEW, MAX_PER_PAGE, USER_BY_ID, bp, db_connector
+from models import BookListItem, parse_genres
+from mysqldb import PRIMARY
+from passwords import passwords
+
+# Замеры и диагностика на настоящей БД: flask books bench-statements,
+# bench-hydration, bench-login и check-replicas. Модуль импортирует app.py
+# после объявления bp, поэтому команды попадают в ту же группу flask books
+
+
+@bp.cli.command("check-replicas")
+def check_replicas():
+    # Маршрутизация на настоящих серверах из MYSQL_REPLICAS: чтение идёт
+    # на реплику, после записи — на основной сервер, отстающая реплика
+    # не используется
+    app = current_app._get_current_object()
+    if not app.config.get("MYSQL_REPLICAS"):
+        raise click.ClickException("MYSQL_REPLICAS не задан")
+
+    def server(method="GET", sticky=False):
+        # Отдельный контекст приложения на запрос: свой g и возврат соединений
+        with app.app_context(), app.test_request_context("/", method=method):
+            if sticky:
+                db_connector.stick_to_primary()
+            with db_connector.connect().cursor() as cursor:
+                cursor.execute("SELECT @@server_id")
+                (server_id,) = cursor.fetchone()
+            return db_connector.target(), server_id
+
+    _, primary_id = server("POST")
+    for target in db_connector.replicas:
+        print(f"реплика {target}: отставание {db_connector.replica_lag(target)} с")
+
+    failed = False
+
+    def check(name, result, expected_replica):
+        nonlocal failed
+        target, server_id = result
+        on_replica = target != PRIMARY and server_id != primary_id
+        ok = on_replica == expected_replica
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {target}, server_id={server_id}")
+
+    db_connector.forget_replica_health()
+    check("GET читает с реплики", server(), True)
+    check("POST пишет на основной", server("POST"), False)
+    check("GET после записи — на основном", server(sticky=True), False)
+    max_lag = app.config["MYSQL_MAX_REPLICA_LAG"]
+    app.config["MYSQL_MAX_REPLICA_LAG"] = -1
+    db_connector.forget_replica_health()
+    try:
+        check("GET при отставании реплик — на основном", server(), False)
+    finally:
+        app.config["MYSQL_MAX_REPLICA_LAG"] = max_lag
+        db_connector.forget_replica_health()
+    if failed:
+        raise SystemExit(1)
+
+
+@bp.cli.command("bench-statements")
+@click.option("--iterations", "-n", default=1000, show_default=True)
+def bench_statements(iterations):
+    with db_connector.connect().cursor(named_tuple=True) as cursor:
+        cursor.execute("SELECT MIN(book_id) AS book_id FROM books")
+        book_id = cursor.fetchone().book_id
+        cursor.execute("SELECT MIN(user_id) AS user_id FROM users")
+        user_id = cursor.fetchone().user_id
+    book_list = db_connector.statement(
+        "book_list",
+        BOOK_LIST_SQL.format(
+            page_query="ORDER BY year DESC, book_id DESC LIMIT %s OFFSET %s"
+        ),
+        BookListItem,
+    )
+    workload = [
+        (USER_BY_ID, (user_id,)),
+        (BOOK_VIEW, (book_id,)),
+        (book_list, (MAX_PER_PAGE, 0)),
+    ]
+    for prepared in (False, True):
+        for statement, params in workload:
+            db_connector.query(statement, params, prepared=prepared)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                db_connector.query(statement, params, prepared=prepared)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{'prepared' if prepared else 'text':8} {statement.name:12} "
+                f"{elapsed / iterations * 1e6:8.1f} мкс/запрос"
+            )
+
+
+@bp.cli.command("bench-hydration")
+@click.option("--rows", "-n", default=10000, show_default=True)
+@click.option("--repeat", "-r", default=5, show_default=True)
+def bench_hydration(rows, repeat):
+    # Строки списка книг из БД (не больше rows) проходят оба пути: прежний —
+    # курсор named_tuple, затем _asdict() и разбор жанров, новый — кортежи
+    # курсора сразу в BookListItem. Время — лучшее из repeat выполнений
+    # с чтением результата, память — пик tracemalloc отдельного выполнения
+    import tracemalloc
+
+    sql = BOOK_LIST_SQL.format(page_query="ORDER BY year DESC, book_id DESC LIMIT %s")
+
+    def named_tuples(cursor):
+        books = []
+        for book in cursor.fetchall():
+            book = book._asdict()
+            book["genres"] = parse_genres(book["genres"])
+            books.append(book)
+        return books
+
+    def models(cursor):
+        return [BookListItem(*row) for row in cursor.fetchall()]
+
+    def run(cursor_options, hydrate):
+        with db_connector.connect().cursor(**cursor_options) as cursor:
+            cursor.execute(sql, (rows,))
+            start = time.perf_counter()
+            result = hydrate(cursor)
+            return result, time.perf_counter() - start
+
+    paths = (
+        ("named_tuple", {"named_tuple": True}, named_tuples),
+        ("models", {}, models),
+    )
+    for name, cursor_options, hydrate in paths:
+        elapsed = min(run(cursor_options, hydrate)[1] for _ in range(repeat))
+        tracemalloc.start()
+        result, _ = run(cursor_options, hydrate)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name:12} {elapsed * 1000:8.1f} мс, "
+            f"пик памяти {peak / 1024 / 1024:6.1f} МиБ на {len(result)} строк"
+        )
+        del result
+
+
+@bp.cli.command("bench-login")
+@click.option("--iterations", "-n", default=500, show_default=True)
+@click.option("--sizes", default="1000,10000,100000", show_default=True)
+def bench_login(iterations, sizes):
+    # Копия таблицы users во временной таблице сеанса растёт до каждого из
+    # размеров; прежний вход (без индекса, SHA2 в MySQL) сравнивается
+    # с поиском по индексу и проверкой пароля в приложении
+    import hashlib
+    import random
+
+    legacy = hashlib.sha256(b"password").hexdigest()
+    connection = db_connector.connect(primary=True)
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE bench_users LIKE users")
+        try:
+            count = 0
+            for size in sorted(int(size) for size in sizes.split(",")):
+                while count < size:
+                    batch = range(count, min(size, count + 1000))
+                    cursor.executemany(
+                        "INSERT INTO bench_users "
+                        "(login, password, first_name, middle_name, last_name, role_id) "
+                        "VALUES (%s, %s, '', '', '', 3)",
+                        [(f"bench{i}", legacy) for i in batch],
+                    )
+                    count = batch.stop
+                connection.commit()
+                logins = [f"bench{random.randrange(size)}" for _ in range(iterations)]
+
+                start = time.perf_counter()
+                for login in logins:
+                    cursor.execute(
+                        "SELECT user_id FROM bench_users IGNORE INDEX (users_login) "
+                        "WHERE login = %s AND password = SHA2(%s, 256)",
+                        (login, "password"),
+                    )
+                    cursor.fetchall()
+                scan = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for login in logins:
+                    cursor.execute(
+                        "SELECT user_id, password FROM bench_users WHERE login = %s",
+                        (login,),
+                    )
+                    passwords.verify("password", cursor.fetchall()[0][1])
+                indexed = time.perf_counter() - start
+                print(
+                    f"{size:>8} пользователей: без индекса {iterations / scan:8.0f} входов/с, "
+                    f"по индексу {iterations / indexed:8.0f} входов/с"
+                )
+        finally:
+            cursor.execute("DROP TEMPORARY TABLE IF EXISTS bench_users")
+    # Основной хэшер намеренно медленный: его время не зависит от размера
+    # таблицы и ограничивает число входов на одно ядро
+    encoded = passwords.hash("password")
+    passwords.verify("password", encoded)
+    rounds = max(1, iterations // 50)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        passwords.verify("password", encoded)
+    elapsed = time.perf_counter() - start
+    print(f"проверка хэша {encoded.split('$', 1)[0]}: {rounds / elapsed:.1f} входов/с")
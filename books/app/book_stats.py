@@ -0,0 +1,48 @@
+RATINGS = range(0, 6)
+
+STAT_COLUMNS = ["review_count", "rating_sum"] + [f"rating_{r}" for r in RATINGS]
+
+_COLUMNS = ", ".join(STAT_COLUMNS)
+_PLACEHOLDERS = ", ".join(["%s"] * len(STAT_COLUMNS))
+_INCREMENTS = ", ".join(f"{column} = {column} + %s" for column in STAT_COLUMNS)
+_OVERWRITES = ", ".join(f"{column} = VALUES({column})" for column in STAT_COLUMNS)
+_HISTOGRAM = ", ".join(
+    f"COUNT(CASE WHEN r.rating = {r} THEN 1 END)" for r in RATINGS
+)
+
+
+def _deltas(rating, sign):
+    return (sign, sign * rating) + tuple(sign if r == rating else 0 for r in RATINGS)
+
+
+def add_review(cursor, book_id, rating):
+    deltas = _deltas(rating, 1)
+    cursor.execute(
+        f"""
+        INSERT INTO book_stats (book_id, {_COLUMNS})
+        VALUES (%s, {_PLACEHOLDERS})
+        ON DUPLICATE KEY UPDATE {_INCREMENTS}
+        """,
+        (book_id, *deltas, *deltas),
+    )
+
+
+def remove_review(cursor, book_id, rating):
+    cursor.execute(
+        f"UPDATE book_stats SET {_INCREMENTS} WHERE book_id = %s",
+        (*_deltas(rating, -1), book_id),
+    )
+
+
+def backfill(cursor):
+    cursor.execute(
+        f"""
+        INSERT INTO book_stats (book_id, {_COLUMNS})
+        SELECT b.book_id, COUNT(r.review_id), COALESCE(SUM(r.rating), 0), {_HISTOGRAM}
+        FROM books b
+        LEFT JOIN reviews r ON r.book_id = b.book_id
+        GROUP BY b.book_id
+        ON DUPLICATE KEY UPDATE {_OVERWRITES}
+        """
+    )
+    return cursor.rowcount
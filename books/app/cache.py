@@ -0,0 +1,323 @@
+import fcntl
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class VersionFile:
+    # Общий для всех воркеров на хосте счётчик версий в небольшом файле
+    def __init__(self, path):
+        self.path = path
+
+    def get(self):
+        try:
+            with open(self.path, "rb") as file:
+                return int(file.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a+b") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            version = int(file.read() or 0) + 1
+            file.seek(0)
+            file.truncate()
+            file.write(str(version).encode())
+            file.flush()
+        return version
+
+
+class MemoryStore:
+    # Значения в памяти процесса (LRU по числу записей), версии — в файлах,
+    # общих для воркеров на хосте
+    def __init__(self, directory, maxsize=1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = [value, time.time() + ttl, 0]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def claim(self, key, seconds):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] > now:
+                return False
+            entry[2] = now + seconds
+            return True
+
+    def version(self, name):
+        return VersionFile(os.path.join(self.directory, f"{name}.version")).get()
+
+    def bump(self, name):
+        return VersionFile(os.path.join(self.directory, f"{name}.version")).bump()
+
+
+class SharedStore:
+    # Одна база SQLite на хост: значения и версии видят все воркеры, запись
+    # атомарна (транзакция), объём ограничен max_bytes с вытеснением записей,
+    # которые истекают раньше других
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connection(self):
+        # Соединение своё у каждого потока и не переживает fork
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                lease_until REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+            CREATE TABLE IF NOT EXISTS versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            """
+        )
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires FROM entries WHERE key = ? AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires) "
+                "VALUES (?, ?, ?, ?)",
+                (key, data, len(data), now + ttl),
+            )
+            self._evict(connection, now)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        while True:
+            (size,) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            if size <= self.max_bytes:
+                return
+            connection.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY expires LIMIT 16)"
+            )
+
+    def claim(self, key, seconds):
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE entries SET lease_until = ? WHERE key = ? AND lease_until <= ?",
+            (now + seconds, key, now),
+        )
+        return cursor.rowcount == 1
+
+    def version(self, name):
+        row = self._connection().execute(
+            "SELECT version FROM versions WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        self._connection().execute(
+            "INSERT INTO versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = version + 1",
+            (name,),
+        )
+        return self.version(name)
+
+
+_shared_stores = {}
+
+
+def make_store(app, maxsize=1024):
+    # CACHE_BACKEND = "shared" — общий для воркеров SQLite, иначе память процесса
+    cache_dir = app.config.get("CACHE_DIR") or app.instance_path
+    if app.config.get("CACHE_BACKEND", "memory") != "shared":
+        return MemoryStore(cache_dir, maxsize)
+    path = app.config.get("CACHE_SHARED_PATH") or os.path.join(
+        cache_dir, "cache.sqlite3"
+    )
+    if path not in _shared_stores:
+        _shared_stores[path] = SharedStore(
+            path, app.config.get("CACHE_SHARED_MAX_BYTES", 64 * 1024 * 1024)
+        )
+    return _shared_stores[path]
+
+
+class CacheSettings:
+    # Хранилище и параметры кэша в одном приложении: объект кэша общий для
+    # модуля, а это — в app.extensions["caches"]
+    def __init__(self, store, ttl, stale=0):
+        self.store = store
+        self.ttl = ttl
+        self.stale = stale
+
+
+class AppCache:
+    def register(self, app, settings):
+        app.extensions.setdefault("caches", {})[self] = settings
+
+    @property
+    def settings(self):
+        return current_app.extensions["caches"][self]
+
+    @property
+    def store(self):
+        return self.settings.store
+
+
+class VersionedCache(AppCache):
+    # Одно значение, сбрасываемое при смене общей версии (после записи
+    # в любом воркере) или по истечении TTL
+    def __init__(self, name):
+        self.name = name
+        self.ttl = 300
+
+    def init_app(self, app, ttl=None):
+        ttl = ttl or app.config.get("CACHE_TTL", self.ttl)
+        self.register(app, CacheSettings(make_store(app, maxsize=4), ttl))
+
+    def get(self, loader):
+        settings = self.settings
+        key = f"{self.name}:{settings.store.version(self.name)}"
+        found = settings.store.get(key)
+        if found is not None:
+            return found[0]
+        value = loader()
+        settings.store.set(key, value, settings.ttl)
+        return value
+
+    def invalidate(self):
+        self.store.bump(self.name)
+
+
+class TTLCache(AppCache):
+    # Кэш с TTL для каждой записи; смена общей версии сбрасывает все записи
+    def __init__(self, name, maxsize=1024, ttl=60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    def init_app(self, app, maxsize=None, ttl=None):
+        store = make_store(app, maxsize=maxsize or self.maxsize)
+        self.register(app, CacheSettings(store, ttl or self.ttl))
+
+    def get(self, key, loader):
+        settings = self.settings
+        store_key = f"{self.name}:{settings.store.version(self.name)}:{key!r}"
+        found = settings.store.get(store_key)
+        if found is not None:
+            return found[0]
+        value = loader(key)
+        if value is not None:
+            settings.store.set(store_key, value, settings.ttl)
+        return value
+
+    def invalidate(self):
+        self.store.bump(self.name)
+
+
+class PageCache(AppCache):
+    # Готовые ответы по ключу: запись действует, пока не сменились версии
+    # данных, переданные при её сохранении. После TTL ответ ещё stale секунд
+    # отдаётся устаревшим, пока один запрос его обновляет.
+    def __init__(self, name, maxsize=512, ttl=0, stale=30, refresh_timeout=10):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale = stale
+        self.refresh_timeout = refresh_timeout
+
+    def init_app(self, app, maxsize=None, ttl=None, stale=None):
+        self.register(
+            app,
+            CacheSettings(
+                make_store(app, maxsize=maxsize or self.maxsize),
+                ttl if ttl is not None else self.ttl,
+                stale if stale is not None else self.stale,
+            ),
+        )
+
+    @property
+    def enabled(self):
+        return self.settings.ttl > 0
+
+    def lookup(self, key, versions):
+        # Версии снимаются до отрисовки и те же передаются в save, чтобы не
+        # сохранить страницу, устаревшую из-за записи во время её построения
+        store_key = f"{self.name}:{key}"
+        found = self.store.get(store_key)
+        if found is None:
+            return None
+        value, entry_versions, fresh_until = found[0]
+        if entry_versions != versions:
+            return None
+        if time.time() < fresh_until:
+            return value
+        # Устаревшую запись обновляет тот, кто первым взял её в аренду,
+        # остальные (в том числе в других воркерах) получают её как есть
+        if self.store.claim(store_key, self.refresh_timeout):
+            return None
+        return value
+
+    def save(self, key, versions, value):
+        settings = self.settings
+        settings.store.set(
+            f"{self.name}:{key}",
+            (value, versions, time.time() + settings.ttl),
+            settings.ttl + settings.stale,
+        )
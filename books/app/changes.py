@@ -0,0 +1,228 @@
+import threading
+import time
+
+from flask import current_app
+
+BOOK = "book"
+REVIEW = "review"
+GENRES = "genres"
+CATALOG = "catalog"
+ROLES = "roles"
+KINDS = (BOOK, REVIEW, GENRES, CATALOG, ROLES)
+
+# Сколько последних изменений перечитывается при старте: их транзакции
+# могли получить номер раньше, а зафиксироваться позже загрузки
+STARTUP_WINDOW = 100
+
+
+class ChangeLog:
+    # Состояние журнала на одном сервере. Изменения применяются строго по
+    # порядку номеров: версия растёт, только когда видны все более ранние
+    # изменения, поэтому поздно зафиксированное изменение с меньшим номером
+    # тоже её меняет. Версии зависят только от содержимого журнала и
+    # совпадают во всех воркерах, дочитавших его до того же номера.
+    def __init__(self, gap_timeout):
+        self.gap_timeout = gap_timeout
+        self.version = None
+        self.catalog_version = 0
+        self.all_books_version = 0
+        self.book_versions = {}
+        self.catalog_modified = None
+        self.all_books_modified = None
+        self.book_modified_at = {}
+        self.polled_at = 0
+        self._pending = {}
+        self._gaps = {}
+
+    def book_version(self, book_id):
+        return max(self.book_versions.get(book_id, 0), self.all_books_version)
+
+    def book_modified(self, book_id):
+        # Время последнего изменения книги (Unix time) или None
+        times = [self.book_modified_at.get(book_id), self.all_books_modified]
+        return max((t for t in times if t is not None), default=None)
+
+    def poll(self, cursor):
+        # Возвращает применённые изменения [(version, kind, book_id, changed_at)]
+        self.polled_at = time.monotonic()
+        if self.version is None:
+            self._load(cursor)
+        cursor.execute(
+            """
+            SELECT version, kind, book_id, UNIX_TIMESTAMP(changed_at)
+            FROM catalog_changes
+            WHERE version > %s
+            ORDER BY version
+            LIMIT 1000
+        """,
+            (self.version,),
+        )
+        for version, kind, book_id, changed_at in cursor.fetchall():
+            self._pending.setdefault(version, (kind, book_id, changed_at))
+        return self._advance()
+
+    def _load(self, cursor):
+        # Последние изменения проходят через _advance, как при опросе,
+        # более ранние сворачиваются до последнего по каждой книге
+        cursor.execute(
+            """
+            SELECT version, kind, book_id, UNIX_TIMESTAMP(changed_at)
+            FROM catalog_changes
+            ORDER BY version DESC
+            LIMIT %s
+        """,
+            (STARTUP_WINDOW,),
+        )
+        recent = cursor.fetchall()
+        self.version = recent[-1][0] - 1 if recent else 0
+        cursor.execute(
+            """
+            SELECT book_id, MAX(version), UNIX_TIMESTAMP(MAX(changed_at))
+            FROM catalog_changes
+            WHERE version <= %s
+            GROUP BY book_id
+        """,
+            (self.version,),
+        )
+        for book_id, version, changed_at in cursor.fetchall():
+            self._apply(version, book_id, changed_at)
+        for version, kind, book_id, changed_at in recent:
+            self._pending[version] = (kind, book_id, changed_at)
+
+    def _apply(self, version, book_id, changed_at):
+        changed_at = float(changed_at)
+        self.catalog_version = max(self.catalog_version, version)
+        self.catalog_modified = max(self.catalog_modified or 0, changed_at)
+        if book_id is None:
+            self.all_books_version = max(self.all_books_version, version)
+            self.all_books_modified = max(self.all_books_modified or 0, changed_at)
+        else:
+            self.book_versions[book_id] = max(self.book_versions.get(book_id, 0), version)
+            self.book_modified_at[book_id] = max(
+                self.book_modified_at.get(book_id, 0), changed_at
+            )
+
+    def _advance(self):
+        # Номера выдаются при вставке, а видны после фиксации, поэтому
+        # пропуск ждёт gap_timeout секунд: дольше — откаченная транзакция
+        now = time.monotonic()
+        top = max(self._pending, default=self.version)
+        for version in range(self.version + 1, top):
+            if version not in self._pending:
+                self._gaps.setdefault(version, now)
+        applied = []
+        while True:
+            version = self.version + 1
+            change = self._pending.pop(version, None)
+            if change is not None:
+                kind, book_id, changed_at = change
+                self._apply(version, book_id, changed_at)
+                applied.append((version, kind, book_id, changed_at))
+            elif now - self._gaps.get(version, now) <= self.gap_timeout:
+                break
+            self._gaps.pop(version, None)
+            self.version = version
+        return applied
+
+
+class ChangesState:
+    # Журналы серверов одного приложения (app.extensions["catalog_changes"])
+    def __init__(self, interval, gap_timeout):
+        self.interval = interval
+        self.gap_timeout = gap_timeout
+        self.logs = {}
+        self.notified = 0
+        self.lock = threading.Lock()
+
+
+class CatalogChanges:
+    # Версии каталога и отдельных книг по журналу catalog_changes. Версия
+    # книги — номер её последнего изменения (или изменения всего каталога)
+    # и служит ключом кэшей. Журнал читается с того же сервера, что и данные
+    # запроса (основного или реплики), и отдельно для каждого из них: данные,
+    # прочитанные после опроса, не старше версии, под которой их кэшируют.
+    def __init__(self, db_connector):
+        self.db_connector = db_connector
+        self._listeners = {}
+
+    def init_app(self, app):
+        app.extensions["catalog_changes"] = ChangesState(
+            app.config.get("CATALOG_POLL_INTERVAL", 1),
+            app.config.get("CATALOG_GAP_TIMEOUT", 10),
+        )
+        app.before_request(self.refresh)
+
+    @property
+    def state(self):
+        return current_app.extensions["catalog_changes"]
+
+    def listen(self, kind, function, each_server=False):
+        # function(changes) получает применённые опросом изменения вида kind
+        # один раз на процесс, а с each_server — от журнала каждого сервера,
+        # когда изменение стало видно на нём (например, для очистки прокси).
+        # Повторная подписка (create_app вызывается не один раз) не дублируется
+        listeners = self._listeners.setdefault(kind, [])
+        if (function, each_server) not in listeners:
+            listeners.append((function, each_server))
+
+    @staticmethod
+    def record(cursor, kind, book_id=None):
+        cursor.execute(
+            "INSERT INTO catalog_changes (kind, book_id) VALUES (%s, %s)",
+            (kind, book_id),
+        )
+
+    @property
+    def log(self):
+        state = self.state
+        target = self.db_connector.target()
+        log = state.logs.get(target)
+        if log is None:
+            log = state.logs.setdefault(target, ChangeLog(state.gap_timeout))
+        return log
+
+    @property
+    def catalog_version(self):
+        return self.log.catalog_version
+
+    @property
+    def catalog_modified(self):
+        return self.log.catalog_modified
+
+    def book_version(self, book_id):
+        return self.log.book_version(book_id)
+
+    def book_modified(self, book_id):
+        return self.log.book_modified(book_id)
+
+    def refresh(self):
+        if time.monotonic() - self.log.polled_at >= self.state.interval:
+            self.poll()
+
+    def poll(self):
+        # Возвращает применённые изменения [(version, kind, book_id, changed_at)]
+        state = self.state
+        log = self.log
+        with state.lock:
+            loaded = log.version is not None
+            # Курсор без учёта в статистике запроса: опрос идёт раз в interval
+            # секунд и не должен влиять на assert_max_queries и Server-Timing
+            with self.db_connector.connect().raw.cursor() as cursor:
+                applied = log.poll(cursor)
+            # Каждый сервер применяет те же изменения: слушатели узнают
+            # о них один раз, от первого дочитавшего
+            fresh = [change for change in applied if change[0] > state.notified]
+            if applied:
+                state.notified = max(state.notified, applied[-1][0])
+        self._notify(fresh, each_server=False)
+        # Изменения из окна загрузки журнала уже были видны до старта процесса
+        if loaded:
+            self._notify(applied, each_server=True)
+        return applied
+
+    def _notify(self, applied, each_server):
+        for kind in dict.fromkeys(change[1] for change in applied):
+            kind_changes = [change for change in applied if change[1] == kind]
+            for function, every in self._listeners.get(kind, ()):
+                if every == each_server:
+                    function(kind_changes)
@@ -8,4 +8,94 @@ MYSQL_DATABASE = "std_2390_books"
 MYSQL_PASSWORD = "Zilant97"
 MYSQL_HOST = "std-mysql"
 ADMIN_ROLE_ID = 1
-MODER_ROLE_ID = 2
\ No newline at end of file
+MODER_ROLE_ID = 2
+
+MYSQL_POOL_SIZE = 5
+MYSQL_POOL_MAX_OVERFLOW = 10
+MYSQL_POOL_TIMEOUT = 30
+MYSQL_POOL_PRE_PING = True
+
+# Кэширование: каталог для общих файлов версий (по умолчанию instance/)
+CACHE_DIR = None
+CACHE_TTL = 300
+# При большем числе книг (по статистике таблицы) считать их приблизительно
+APPROX_COUNT_THRESHOLD = None
+
+# Кэш отрисовки markdown в каждом воркере, байт
+RENDER_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Кэш пользователей для Flask-Login в каждом воркере
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60
+
+# Предупреждать в логе, если один запрос повторяется за запрос страницы столько раз
+N_PLUS_ONE_THRESHOLD = 5
+
+# Уровень журнала приложения: на INFO пишется сводка SQL-запросов каждого запроса
+LOG_LEVEL = "INFO"
+
+# Кэш списка жанров и отрисованных блоков выбора жанров, секунд
+GENRE_CACHE_TTL = 600
+
+# Отрисованные строки списка книг: по одной на книгу, её версию и роль
+BOOK_ROW_CACHE_SIZE = 4096
+BOOK_ROW_CACHE_TTL = 600
+
+# Повторы транзакций при взаимоблокировках: число попыток и базовая задержка, с
+DB_TRANSACTION_RETRIES = 3
+DB_RETRY_BACKOFF = 0.05
+
+# Реплики только для чтения, например для двух локальных экземпляров MySQL:
+# MYSQL_REPLICAS = [{"host": "127.0.0.1", "port": 3307}]
+# Для проверки отставания пользователю БД нужно право на каждой реплике:
+# GRANT REPLICATION CLIENT ON *.* TO 'std_2390_books'@'%';
+# Проверить маршрутизацию на настроенных серверах: flask books check-replicas
+MYSQL_REPLICAS = []
+# После записи пользователь читает с основного сервера столько секунд
+MYSQL_STICKY_SECONDS = 5
+# Реплика с отставанием больше этого (с) не используется; проверка раз в интервал
+MYSQL_MAX_REPLICA_LAG = 2
+MYSQL_LAG_CHECK_INTERVAL = 5
+# Ожидание свободного соединения для проверки отставания, с
+MYSQL_LAG_CHECK_TIMEOUT = 1
+# Таймаут подключения к реплике, с; он же ограничивает ожидание её ответа.
+# Можно переопределить ключом connection_timeout в описании реплики
+MYSQL_REPLICA_CONNECT_TIMEOUT = 5
+
+# Частые запросы выполняются как подготовленные (бинарный протокол);
+# False возвращает текстовый протокол, например для прокси без их поддержки
+MYSQL_PREPARED_STATEMENTS = True
+
+# Кэш страниц для анонимных посетителей, секунд (0 — выключен); после TTL
+# страница ещё PAGE_CACHE_STALE секунд отдаётся устаревшей, пока обновляется
+PAGE_CACHE_TTL = 0
+PAGE_CACHE_STALE = 30
+PAGE_CACHE_SIZE = 512
+
+# Хранилище кэшей: "memory" — своё у каждого воркера, "shared" — общий для
+# воркеров на хосте файл SQLite (по умолчанию CACHE_DIR/cache.sqlite3)
+CACHE_BACKEND = "memory"
+CACHE_SHARED_PATH = None
+CACHE_SHARED_MAX_BYTES = 64 * 1024 * 1024
+
+# Опрос журнала изменений каталога (catalog_changes) не чаще раза в столько
+# секунд; пропуск в номерах версий ждёт фиксации транзакции не дольше таймаута
+CATALOG_POLL_INTERVAL = 1
+CATALOG_GAP_TIMEOUT = 10
+
+# Увеличивается при изменении шаблонов, чтобы сменились ETag страниц
+TEMPLATES_VERSION = 1
+
+# Кэширование в обратном прокси: страницы каталога для анонимов хранятся
+# s-maxage секунд и ещё stale — пока прокси их обновляет. При изменениях
+# приложение отправляет PURGE с ключами страниц на SURROGATE_PURGE_URL
+HTTP_CACHE_S_MAXAGE = 60
+HTTP_CACHE_STALE = 30
+SURROGATE_KEY_HEADER = "Surrogate-Key"
+SURROGATE_PURGE_URL = None
+SURROGATE_PURGE_HEADER = "Surrogate-Key"
+SURROGATE_PURGE_TIMEOUT = 2
+
+# Метод хэширования новых паролей (werkzeug.security), например scrypt или
+# pbkdf2:sha256:600000. Пароли в другом формате перехэшируются при входе
+PASSWORD_HASH_METHOD = "scrypt"
@@ -0,0 +1,35 @@
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:1405")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "sync"
+preload_app = True
+# Приложение создаётся фабрикой: импорт модуля app его не строит
+wsgi_app = "app:create_app()"
+errorlog = "gunicorn.log"
+
+
+def when_ready(server):
+    # Мастер уже импортировал приложение (preload_app): компилируем шаблоны
+    # и строим матрицу прав заранее и замораживаем объекты, чтобы воркеры
+    # делили их через copy-on-write.
+    from app import db_connector
+    from permissions import permissions
+
+    app = server.app.wsgi()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        permissions.load()
+        # Соединение мастера воркерам не достаётся
+        db_connector.pool.close()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import db_connector
+
+    with server.app.wsgi().app_context():
+        db_connector.init_pool()
@@ -0,0 +1,95 @@
+import urllib.error
+import urllib.request
+
+from flask import current_app, g, request, session
+from flask_login import current_user
+
+
+class HttpCache:
+    # Заголовки кэширования для прокси и браузеров. Страницы с политикой
+    # (декоратор policy) анонимам отдаются как public с ключами для
+    # выборочной очистки (Surrogate-Key), авторизованным — только private;
+    # остальные ответы приложения не кэшируются. Ответ с flash-сообщением,
+    # изменённой сессией или cookie public не бывает.
+    def __init__(self):
+        self._purgers = []
+
+    def init_app(self, app):
+        app.before_request(self.note_flashes)
+        app.after_request(self.apply)
+
+    @staticmethod
+    def note_flashes():
+        # К after_request шаблон уже забрал сообщения из сессии
+        g.flashes_pending = "_flashes" in session
+
+    def policy(self, keys):
+        # keys(**аргументы маршрута) — ключи страницы, например ["book-10"]
+        def decorator(function):
+            function.cache_policy = keys
+            return function
+
+        return decorator
+
+    def purger(self, function):
+        # Регистрирует обработчик function(keys), например очистку в прокси
+        self._purgers.append(function)
+        return function
+
+    def apply(self, response):
+        if request.endpoint is None or request.endpoint == "static":
+            return response
+        if "Cache-Control" in response.headers:
+            return response
+        view = current_app.view_functions.get(request.endpoint)
+        keys = getattr(view, "cache_policy", None)
+        if keys is None:
+            response.headers["Cache-Control"] = "no-store"
+            return response
+        response.vary.add("Cookie")
+        if (
+            current_user.is_authenticated
+            or request.method not in ("GET", "HEAD")
+            or response.status_code not in (200, 304)
+            or g.get("flashes_pending", False)
+            or session.modified
+            or "Set-Cookie" in response.headers
+        ):
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        config = current_app.config
+        response.headers["Cache-Control"] = (
+            f"public, max-age=0, s-maxage={config.get('HTTP_CACHE_S_MAXAGE', 60)}, "
+            f"stale-while-revalidate={config.get('HTTP_CACHE_STALE', 30)}"
+        )
+        header = config.get("SURROGATE_KEY_HEADER", "Surrogate-Key")
+        response.headers[header] = " ".join(keys(**(request.view_args or {})))
+        return response
+
+    def purge(self, *keys):
+        purgers = list(self._purgers)
+        if current_app.config.get("SURROGATE_PURGE_URL"):
+            purgers.append(self.http_purge)
+        for purger in purgers:
+            try:
+                purger(keys)
+            except Exception as error:
+                # Запись уже зафиксирована: неудачная очистка лишь
+                # оставляет страницы в прокси до истечения s-maxage
+                current_app.logger.warning("Не удалось очистить кэш %s: %s", keys, error)
+
+    def http_purge(self, keys):
+        # PURGE с ключами в заголовке: так их принимают Varnish (xkey) и
+        # совместимые прокси; имя заголовка задаётся SURROGATE_PURGE_HEADER
+        config = current_app.config
+        purge = urllib.request.Request(
+            config["SURROGATE_PURGE_URL"],
+            method="PURGE",
+            headers={
+                config.get("SURROGATE_PURGE_HEADER", "Surrogate-Key"): " ".join(keys)
+            },
+        )
+        with urllib.request.urlopen(
+            purge, timeout=config.get("SURROGATE_PURGE_TIMEOUT", 2)
+        ):
+            pass
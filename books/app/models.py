@@ -0,0 +1,125 @@
+from collections import namedtuple
+
+from permissions import permissions
+
+# Разделитель GROUP_CONCAT в запросах, возвращающих жанры книги
+GENRE_SEPARATOR = ", "
+
+
+def parse_genres(genres):
+    return genres.split(GENRE_SEPARATOR) if genres else []
+
+
+# Кортеж, а не класс со слотами: жанры служат ключом кэша фрагментов
+# и сохраняются в общем кэше
+Genre = namedtuple("Genre", ("genre_id", "genre_name"))
+
+
+# Модели создаются прямо из строк курсора: позиционные аргументы конструктора
+# совпадают с порядком столбцов в запросе, __slots__ не заводит словарь на объект
+
+
+class BookListItem:
+    __slots__ = ("book_id", "book_name", "year", "genres", "avg_rating", "review_count")
+
+    def __init__(self, book_id, book_name, year, genres, avg_rating, review_count):
+        self.book_id = book_id
+        self.book_name = book_name
+        self.year = year
+        self.genres = parse_genres(genres)
+        self.avg_rating = avg_rating
+        self.review_count = review_count
+
+
+class Book:
+    __slots__ = (
+        "book_id",
+        "book_name",
+        "book_description",
+        "book_description_html",
+        "render_version",
+        "year",
+        "publishing_house",
+        "author",
+        "volume_pages",
+        "cover_id",
+        "genres",
+        "avg_rating",
+        "review_count",
+    )
+
+    def __init__(
+        self,
+        book_id,
+        book_name,
+        book_description,
+        book_description_html,
+        render_version,
+        year,
+        publishing_house,
+        author,
+        volume_pages,
+        cover_id,
+        genres,
+        avg_rating,
+        review_count,
+    ):
+        self.book_id = book_id
+        self.book_name = book_name
+        self.book_description = book_description
+        self.book_description_html = book_description_html
+        self.render_version = render_version
+        self.year = year
+        self.publishing_house = publishing_house
+        self.author = author
+        self.volume_pages = volume_pages
+        self.cover_id = cover_id
+        self.genres = parse_genres(genres)
+        self.avg_rating = avg_rating
+        self.review_count = review_count
+
+
+class Review:
+    __slots__ = ("review_id", "rating", "text", "user_id", "date", "username")
+
+    def __init__(self, review_id, rating, text, user_id, date=None, username=None):
+        self.review_id = review_id
+        self.rating = rating
+        self.text = text
+        self.user_id = user_id
+        self.date = date
+        self.username = username
+
+
+class User:
+    # Интерфейс Flask-Login реализован здесь, а не через UserMixin,
+    # у которого нет __slots__
+    __slots__ = ("id", "user_login", "role_id", "first_name", "middle_name", "last_name")
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(
+        self, user_id, user_login, role_id, first_name, middle_name, last_name
+    ):
+        self.id = user_id
+        self.user_login = user_login
+        self.role_id = role_id
+        self.first_name = first_name
+        self.middle_name = middle_name
+        self.last_name = last_name
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def can(self, action):
+        return permissions.allowed(self.role_id, action)
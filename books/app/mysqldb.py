@@ -1,26 +1,527 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
 import mysql.connector
-from flask import g
+from mysql.connector import errorcode, errors
+from flask import current_app, g, has_request_context, request, session
+
+
+# Взаимоблокировка и превышение ожидания блокировки: транзакцию можно повторить
+RETRYABLE_ERRORS = (1213, 1205)
+
+# nextset() у обычного курсора есть с mysql-connector-python 9.2, в более
+# ранних версиях наборы результатов CALL доступны только через callproc()
+NEXTSET_SUPPORTED = mysql.connector.__version_info__[:2] >= (9, 2)
+
+
+class PoolTimeout(errors.PoolError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, config, size=5, max_overflow=10, timeout=30, pre_ping=True):
+        self.config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size + max_overflow)
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolTimeout(
+                f'Нет свободных соединений с БД (ожидание {timeout} с)'
+            )
+        try:
+            connection = self._get_idle()
+            if connection is None:
+                connection = mysql.connector.connect(**self.config)
+        except Exception:
+            self._slots.release()
+            raise
+        return connection
+
+    def release(self, connection):
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put_nowait(connection)
+        except (errors.Error, queue.Full):
+            self._close(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def _get_idle(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if not self.pre_ping or self._is_alive(connection):
+                return connection
+            self._close(connection)
+
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except errors.Error:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except errors.Error:
+            pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = (0.0, None)
+        self.statements = Counter()
+        self.retries = 0
+
+    def record(self, operation, duration):
+        statement = " ".join(str(operation).split())
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+        if duration >= self.slowest[0]:
+            self.slowest = (duration, statement)
+
+    def repeated(self, threshold):
+        return [(s, n) for s, n in self.statements.items() if n >= threshold]
+
+    def server_timing(self):
+        return (
+            f'db;dur={self.duration * 1000:.1f};'
+            f'desc="{self.count} queries, {self.retries} retries"'
+        )
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, operation, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, *args, **kwargs)
+        finally:
+            self._stats.record(operation, time.perf_counter() - start)
+
+    def executemany(self, operation, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, *args, **kwargs)
+        finally:
+            self._stats.record(operation, time.perf_counter() - start)
+
+    def callproc(self, procname, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.callproc(procname, *args, **kwargs)
+        finally:
+            self._stats.record(f'CALL {procname}', time.perf_counter() - start)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, connection, stats):
+        self.raw = connection
+        self._stats = stats
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self.raw.cursor(*args, **kwargs), self._stats)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class Statement:
+    def __init__(self, name, sql, model=None):
+        self.name = name
+        self.sql = sql
+        self.model = model
+        self.row_type = None
+
+    def hydrate(self, cursor, rows):
+        if self.model is not None:
+            return [self.model(*row) for row in rows]
+        if self.row_type is None:
+            self.row_type = namedtuple('Row', cursor.column_names, rename=True)
+        return [self.row_type(*row) for row in rows]
+
+
+PRIMARY = 'primary'
+
+
+class ConnectorState:
+    # Пулы соединений и здоровье реплик одного приложения
+    def __init__(self):
+        self.pools = {}
+        self.pid = None
+        self.replica_health = {}
+
 
 class DBConnector:
-    def __init__(self, app):
-        self.app = app
-        self.app.teardown_appcontext(self.disconnect)
-
-    def get_config(self):
-        return {
-            'user': self.app.config["MYSQL_USER"],
-            'password': self.app.config["MYSQL_PASSWORD"],
-            'host': self.app.config["MYSQL_HOST"],
-            'database': self.app.config["MYSQL_DATABASE"]
+    # Один объект на модуль обслуживает любое число приложений: настройки
+    # берутся из current_app, пулы — из app.extensions["mysqldb"]
+    def __init__(self, app=None):
+        self._recorders = []
+        self._summaries = []
+        self.statements = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["mysqldb"] = ConnectorState()
+        app.after_request(self.report)
+        app.teardown_appcontext(self.disconnect)
+
+    @property
+    def state(self):
+        return current_app.extensions["mysqldb"]
+
+    def add_summary(self, function):
+        # function() — строка, дописываемая к сводке запроса в журнале,
+        # например счётчики кэша; повторная регистрация не дублируется
+        if function not in self._summaries:
+            self._summaries.append(function)
+
+    def get_config(self, target=PRIMARY):
+        config = {
+            'user': current_app.config["MYSQL_USER"],
+            'password': current_app.config["MYSQL_PASSWORD"],
+            'host': current_app.config["MYSQL_HOST"],
+            'database': current_app.config["MYSQL_DATABASE"]
         }
+        if target != PRIMARY:
+            # Недоступная реплика не должна задерживать запрос на минуты
+            config['connection_timeout'] = current_app.config.get(
+                "MYSQL_REPLICA_CONNECT_TIMEOUT", 5
+            )
+            config.update(current_app.config["MYSQL_REPLICAS"][target])
+        return config
+
+    @property
+    def replicas(self):
+        return range(len(current_app.config.get("MYSQL_REPLICAS") or ()))
+
+    @property
+    def pool(self):
+        return self.pool_for(PRIMARY)
+
+    def pool_for(self, target):
+        # Пулы создаются лениво в каждом процессе: соединения родителя
+        # после fork не переиспользуются и не закрываются из потомка.
+        state = self.state
+        if state.pid != os.getpid():
+            self.init_pool()
+        if target not in state.pools:
+            state.pools[target] = ConnectionPool(
+                self.get_config(target),
+                size=current_app.config.get("MYSQL_POOL_SIZE", 5),
+                max_overflow=current_app.config.get("MYSQL_POOL_MAX_OVERFLOW", 10),
+                timeout=current_app.config.get("MYSQL_POOL_TIMEOUT", 30),
+                pre_ping=current_app.config.get("MYSQL_POOL_PRE_PING", True),
+            )
+        return state.pools[target]
+
+    def init_pool(self):
+        state = self.state
+        state.pid = os.getpid()
+        state.pools = {}
+        state.replica_health = {}
+        return self.pool_for(PRIMARY)
+
+    def forget_replica_health(self):
+        # Следующий запрос к реплике заново проверит её отставание
+        self.state.replica_health = {}
+
+    def target(self):
+        # Сервер, с которого читает текущий запрос (выбирается один раз)
+        if 'db_target' not in g:
+            g.db_target = self.choose_target()
+        return g.db_target
+
+    def connect(self, primary=False):
+        target = PRIMARY if primary else self.target()
+        connections = g.setdefault('db_connections', {})
+        if target not in connections:
+            stats = g.setdefault('db_stats', QueryStats())
+            connections[target] = InstrumentedConnection(
+                self.pool_for(target).acquire(), stats
+            )
+        return connections[target]
 
-    def connect(self):
-        if 'db' not in g:
-            g.db = mysql.connector.connect(**self.get_config())
-        return g.db
-    
     def disconnect(self, e=None):
-        if 'db' in g:
-            g.db.close()
-        g.pop('db', None)
-        
\ No newline at end of file
+        for target, connection in g.pop('db_connections', {}).items():
+            self.pool_for(target).release(connection.raw)
+
+    def choose_target(self):
+        # Реплики обслуживают только читающие запросы; после записи пользователь
+        # некоторое время читает с основного сервера, чтобы видеть свои изменения
+        if not self.replicas or not has_request_context():
+            return PRIMARY
+        if request.method not in ('GET', 'HEAD'):
+            return PRIMARY
+        if session.get('db_primary_until', 0) > time.time():
+            return PRIMARY
+        healthy = [target for target in self.replicas if self.replica_healthy(target)]
+        return random.choice(healthy) if healthy else PRIMARY
+
+    def replica_healthy(self, target):
+        interval = current_app.config.get("MYSQL_LAG_CHECK_INTERVAL", 5)
+        checked_at, healthy = self.state.replica_health.get(target, (0, False))
+        if time.monotonic() - checked_at < interval:
+            return healthy
+        healthy = self.replica_lag(target) <= current_app.config.get(
+            "MYSQL_MAX_REPLICA_LAG", 2
+        )
+        self.state.replica_health[target] = (time.monotonic(), healthy)
+        return healthy
+
+    def replica_lag(self, target):
+        # Проверку не ждут дольше MYSQL_LAG_CHECK_TIMEOUT: занятый пул реплики
+        # тоже повод читать с основного сервера
+        pool = self.pool_for(target)
+        try:
+            connection = pool.acquire(
+                timeout=current_app.config.get("MYSQL_LAG_CHECK_TIMEOUT", 1)
+            )
+        except errors.Error as error:
+            current_app.logger.warning('Реплика %s недоступна: %s', target, error)
+            return float('inf')
+        try:
+            status = self._replica_status(connection)
+        except errors.Error as error:
+            current_app.logger.warning('Не удалось проверить реплику %s: %s', target, error)
+            return float('inf')
+        finally:
+            pool.release(connection)
+        if not status:
+            return float('inf')
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return float('inf') if lag is None else lag
+
+    @staticmethod
+    def _replica_status(connection):
+        # Нужна привилегия REPLICATION CLIENT. SHOW REPLICA STATUS есть
+        # с MySQL 8.0.22, а SHOW SLAVE STATUS удалён в 8.4
+        with connection.cursor(dictionary=True) as cursor:
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+            except errors.ProgrammingError as error:
+                if error.errno != errorcode.ER_PARSE_ERROR:
+                    raise
+                cursor.execute('SHOW SLAVE STATUS')
+            return cursor.fetchone()
+
+    def stick_to_primary(self):
+        if has_request_context():
+            session['db_primary_until'] = (
+                time.time() + current_app.config.get("MYSQL_STICKY_SECONDS", 5)
+            )
+
+    def statement(self, name, sql, model=None):
+        # Реестр именованных запросов: текст разбирается сервером один раз
+        # на соединение, дальше передаются только параметры
+        statement = self.statements.get(name)
+        if statement is None:
+            statement = self.statements[name] = Statement(name, sql, model)
+        elif statement.sql != sql:
+            raise ValueError(f'Запрос {name} уже зарегистрирован с другим текстом')
+        return statement
+
+    def query(self, statement, params=(), primary=False, prepared=None):
+        cursor = self._execute(statement, params, primary, prepared)
+        try:
+            if not cursor.with_rows:
+                return []
+            return statement.hydrate(cursor, cursor.fetchall())
+        finally:
+            if not self._uses_prepared(prepared):
+                cursor.close()
+
+    def query_sets(self, statement, params=(), primary=False):
+        # Хранимая процедура с несколькими наборами результатов: все они
+        # приходят в ответ на один CALL; statement.model — модели по порядку
+        with self.connect(primary=primary).cursor() as cursor:
+            if NEXTSET_SUPPORTED:
+                cursor.execute(statement.sql, tuple(params))
+                result_sets = []
+                while True:
+                    if cursor.with_rows:
+                        result_sets.append(cursor.fetchall())
+                    if not cursor.nextset():
+                        break
+            else:
+                # callproc() отправляет ещё SET для каждого аргумента и SELECT
+                # их значений, зато работает с курсором любой версии
+                procname = statement.sql.split()[1].split('(')[0]
+                cursor.callproc(procname, tuple(params))
+                result_sets = [result.fetchall() for result in cursor.stored_results()]
+        return [
+            [model(*row) for row in rows]
+            for model, rows in zip(statement.model, result_sets)
+        ]
+
+    def execute(self, statement, params=(), primary=True, prepared=None):
+        cursor = self._execute(statement, params, primary, prepared)
+        try:
+            return cursor.rowcount
+        finally:
+            if not self._uses_prepared(prepared):
+                cursor.close()
+
+    def _uses_prepared(self, prepared):
+        if prepared is None:
+            return current_app.config.get("MYSQL_PREPARED_STATEMENTS", True)
+        return prepared
+
+    def _execute(self, statement, params, primary, prepared):
+        connection = self.connect(primary=primary)
+        if self._uses_prepared(prepared):
+            cursor = self._prepared_cursor(connection, statement)
+        else:
+            cursor = connection.cursor()
+        cursor.execute(statement.sql, tuple(params))
+        return cursor
+
+    @staticmethod
+    def _prepared_cursor(connection, statement):
+        # Подготовленные курсоры живут вместе с соединением пула: курсор
+        # повторно готовит запрос, только если ему передан другой текст
+        cursors = getattr(connection.raw, '_prepared_cursors', None)
+        if cursors is None:
+            cursors = connection.raw._prepared_cursors = {}
+        cursor = cursors.get(statement.name)
+        if cursor is None:
+            cursor = cursors[statement.name] = connection.raw.cursor(prepared=True)
+        return InstrumentedCursor(cursor, connection._stats)
+
+    @contextmanager
+    def transaction(self, lock=None):
+        # lock = (таблица, ключ, ids): родительские строки блокируются первыми
+        # и по возрастанию ключа, чтобы параллельные транзакции не пересекались
+        connection = self.connect(primary=True)
+        if connection.in_transaction:
+            connection.rollback()
+        try:
+            with connection.cursor(named_tuple=True, buffered=True) as cursor:
+                if lock is not None:
+                    table, column, ids = lock
+                    ids = sorted(set(ids))
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(
+                        f'SELECT {column} FROM {table} WHERE {column} IN ({placeholders}) '
+                        f'ORDER BY {column} FOR UPDATE',
+                        ids,
+                    )
+                    cursor.fetchall()
+                yield cursor
+            connection.commit()
+            self.stick_to_primary()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def run_in_transaction(self, work, lock=None):
+        attempts = current_app.config.get("DB_TRANSACTION_RETRIES", 3) + 1
+        backoff = current_app.config.get("DB_RETRY_BACKOFF", 0.05)
+        for attempt in range(attempts):
+            try:
+                with self.transaction(lock) as cursor:
+                    return work(cursor)
+            except errors.DatabaseError as error:
+                if error.errno not in RETRYABLE_ERRORS or attempt + 1 == attempts:
+                    raise
+                g.db_stats.retries += 1
+                current_app.logger.warning(
+                    'Повтор транзакции (%d/%d) после ошибки %s',
+                    attempt + 1,
+                    attempts - 1,
+                    error.errno,
+                )
+                time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+    def report(self, response):
+        stats = g.get('db_stats')
+        if stats is None:
+            return response
+        response.headers.add('Server-Timing', stats.server_timing())
+        slowest_duration, slowest_statement = stats.slowest
+        current_app.logger.info(
+            '%s %s: %d SQL-запросов, %d повторов транзакций, %.1f мс, '
+            'самый долгий %.1f мс: %s%s',
+            request.method,
+            request.path,
+            stats.count,
+            stats.retries,
+            stats.duration * 1000,
+            slowest_duration * 1000,
+            (slowest_statement or '')[:200],
+            ''.join(f'; {function()}' for function in self._summaries),
+        )
+        threshold = current_app.config.get("N_PLUS_ONE_THRESHOLD", 5)
+        for statement, count in stats.repeated(threshold):
+            current_app.logger.warning(
+                'Возможный N+1 на %s: запрос выполнен %d раз: %s',
+                request.path,
+                count,
+                statement[:200],
+            )
+        for recorded in self._recorders:
+            recorded.append(stats)
+        return response
+
+    @contextmanager
+    def assert_max_queries(self, limit):
+        # Для тестов: with db_connector.assert_max_queries(3): client.get("/")
+        # Служебные запросы (опрос журнала изменений каталога) не считаются
+        recorded = []
+        self._recorders.append(recorded)
+        try:
+            yield recorded
+        finally:
+            self._recorders.remove(recorded)
+        total = sum(stats.count for stats in recorded)
+        if total > limit:
+            statements = Counter()
+            for stats in recorded:
+                statements.update(stats.statements)
+            details = '\n'.join(f'{n} x {s}' for s, n in statements.most_common())
+            raise AssertionError(
+                f'Выполнено {total} SQL-запросов, допустимо не более {limit}:\n{details}'
+            )
@@ -0,0 +1,47 @@
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+AFTER = "after"
+BEFORE = "before"
+
+# Списки выводятся по убыванию ключа: AFTER — следующая страница, BEFORE — предыдущая
+SEEK_DIRECTIONS = {
+    AFTER: ("<", "DESC"),
+    BEFORE: (">", "ASC"),
+}
+
+
+def _serializer(kind):
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt=f"{kind}-cursor")
+
+
+def encode_cursor(kind, key, direction, page):
+    return _serializer(kind).dumps([list(key), direction, page])
+
+
+def decode_cursor(kind, token):
+    try:
+        key, direction, page = _serializer(kind).loads(token)
+    except (BadSignature, TypeError, ValueError):
+        return None
+    if direction not in SEEK_DIRECTIONS or not isinstance(page, int) or page < 1:
+        return None
+    return {"key": key, "direction": direction, "page": page}
+
+
+def seek_clause(columns, cursor):
+    # Лексикографическое сравнение по составному ключу, которое MySQL
+    # разворачивает в диапазонный поиск по индексу (в отличие от ROW(...) < ROW(...))
+    operator, order = SEEK_DIRECTIONS[cursor["direction"]]
+    key = cursor["key"]
+    if len(key) != len(columns):
+        raise ValueError("Курсор не соответствует ключу сортировки")
+    terms = []
+    params = []
+    for i, column in enumerate(columns):
+        conditions = [f"{prefix} = %s" for prefix in columns[:i]]
+        conditions.append(f"{column} {operator} %s")
+        terms.append("(" + " AND ".join(conditions) + ")")
+        params.extend(key[: i + 1])
+    order_by = ", ".join(f"{column} {order}" for column in columns)
+    return "(" + " OR ".join(terms) + ")", order_by, tuple(params)
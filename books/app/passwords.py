@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import re
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class Sha256Hasher:
+    # Прежний формат: SHA2(пароль, 256) в шестнадцатеричном виде, без соли.
+    # Только проверяет пароль, после входа он перехэшируется основным хэшером.
+    pattern = re.compile(r"[0-9a-f]{64}")
+
+    def identify(self, encoded):
+        return self.pattern.fullmatch(encoded) is not None
+
+    def hash(self, password):
+        return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.hash(password), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+
+class WerkzeugHasher:
+    # Хэши werkzeug.security вида "метод:параметры$соль$хэш", например
+    # scrypt:32768:8:1 или pbkdf2:sha256:600000
+    def __init__(self, method="scrypt"):
+        self.method = method
+        self._prefix = None
+
+    def identify(self, encoded):
+        return encoded.count("$") == 2
+
+    def hash(self, password):
+        return generate_password_hash(password, self.method)
+
+    def verify(self, password, encoded):
+        return check_password_hash(encoded, password)
+
+    def needs_rehash(self, encoded):
+        # Пароль, сохранённый с другим методом или параметрами
+        if self._prefix is None:
+            self._prefix = self.hash("").split("$", 1)[0]
+        return encoded.split("$", 1)[0] != self._prefix
+
+
+class Passwords:
+    # Проверка паролей в приложении. Первый хэшер задаёт формат новых
+    # паролей, остальные нужны для проверки сохранённых в прежних форматах.
+    def __init__(self, *hashers):
+        self.hashers = list(hashers)
+        self._dummy = None
+
+    def hash(self, password):
+        return self.hashers[0].hash(password)
+
+    def verify(self, password, encoded):
+        # (пароль верен, нужно перехэшировать). Быстрый прежний хэшер при
+        # неверном пароле дополняется проверкой основным, иначе по времени
+        # ответа видно, что логин есть (неизвестный оплачивает dummy_verify)
+        for hasher in self.hashers:
+            if hasher.identify(encoded):
+                if not hasher.verify(password, encoded):
+                    if hasher is not self.hashers[0]:
+                        self.dummy_verify(password)
+                    return False, False
+                return True, hasher is not self.hashers[0] or hasher.needs_rehash(
+                    encoded
+                )
+        self.dummy_verify(password)
+        return False, False
+
+    def dummy_verify(self, password):
+        # Для несуществующего логина: ответ занимает столько же времени,
+        # и по нему нельзя узнать, есть ли такой пользователь
+        if self._dummy is None:
+            self._dummy = self.hash("")
+        self.hashers[0].verify(password, self._dummy)
+
+
+class PasswordHashing:
+    # Хэшеры свои у каждого приложения (app.extensions["passwords"]),
+    # обращения к модульному объекту идут к ним через current_app
+    def init_app(self, app):
+        app.extensions["passwords"] = Passwords(
+            WerkzeugHasher(app.config.get("PASSWORD_HASH_METHOD", "scrypt")),
+            Sha256Hasher(),
+        )
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["passwords"], name)
+
+
+passwords = PasswordHashing()
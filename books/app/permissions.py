@@ -0,0 +1,68 @@
+import threading
+from types import MappingProxyType
+
+from flask import current_app
+
+from users_policy import ACTIONS, UsersPolicy
+
+BITS = MappingProxyType({action: 1 << bit for bit, action in enumerate(ACTIONS)})
+
+
+class PermissionMatrix:
+    # Матрица прав: для каждой роли из таблицы roles и для анонимного
+    # посетителя (None) — битовая маска действий UsersPolicy. Строится один
+    # раз на процесс (в мастере gunicorn до fork) и не изменяется:
+    # перезагрузка собирает новую матрицу и подменяет ссылку целиком.
+    def __init__(self, config, db_connector):
+        self.config = config
+        self.db_connector = db_connector
+        self._masks = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self.db_connector.connect().cursor() as cursor:
+            cursor.execute("SELECT role_id FROM roles ORDER BY role_id")
+            role_ids = [row[0] for row in cursor.fetchall()]
+        masks = {role_id: self._mask(role_id) for role_id in [None, *role_ids]}
+        self._masks = MappingProxyType(masks)
+        return self._masks
+
+    def _mask(self, role_id):
+        policy = UsersPolicy(role_id, self.config)
+        mask = 0
+        for action in ACTIONS:
+            if getattr(policy, action)():
+                mask |= BITS[action]
+        return mask
+
+    @property
+    def masks(self):
+        masks = self._masks
+        if masks is None:
+            with self._lock:
+                masks = self._masks or self.load()
+        return masks
+
+    def allowed(self, role_id, action):
+        # Роль, которой нет в таблице roles, прав не имеет
+        return bool(self.masks.get(role_id, 0) & BITS.get(action, 0))
+
+    def actions(self, role_id):
+        mask = self.masks.get(role_id, 0)
+        return [action for action in ACTIONS if mask & BITS[action]]
+
+
+class Permissions:
+    # Матрица своя у каждого приложения (app.extensions["permissions"]),
+    # обращения к модульному объекту идут к матрице current_app
+    def init_app(self, app, db_connector):
+        app.extensions["permissions"] = PermissionMatrix(app.config, db_connector)
+
+    def reload(self, changes=None):
+        return current_app.extensions["permissions"].load()
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["permissions"], name)
+
+
+permissions = Permissions()
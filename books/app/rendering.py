@@ -0,0 +1,128 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import bleach
+import markdown
+
+# Увеличивается при любом изменении отрисовки, чтобы переотрисовать сохранённый HTML
+RENDERER_VERSION = 1
+
+ALLOWED_TAGS = bleach.sanitizer.ALLOWED_TAGS | {
+    "p",
+    "br",
+    "hr",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "pre",
+    "img",
+}
+ALLOWED_ATTRIBUTES = {
+    **bleach.sanitizer.ALLOWED_ATTRIBUTES,
+    "img": ["src", "alt", "title"],
+}
+
+
+class RenderCache:
+    # LRU по хэшу содержимого, ограниченный суммарным размером результатов в байтах
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get("RENDER_CACHE_MAX_BYTES", self.max_bytes)
+
+    def get_or_render(self, kind, text, render):
+        key = (kind, hashlib.blake2b(text.encode(), digest_size=16).digest())
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        result = render(text)
+        self._store(key, result)
+        return result
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
+
+    def summary(self):
+        # Для сводки запроса в журнале (DBConnector.report): счётчики процесса
+        stats = self.stats()
+        return (
+            f"кэш markdown {stats['hits']} попаданий, {stats['misses']} промахов, "
+            f"{stats['entries']} записей, {stats['bytes'] / 1024:.0f} КиБ"
+        )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, key, result):
+        size = len(result.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = result
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.encode())
+
+
+render_cache = RenderCache()
+
+# Экземпляры Markdown и Cleaner хранят состояние разбора, поэтому свои в каждом потоке
+_local = threading.local()
+
+
+def _markdown():
+    if not hasattr(_local, "markdown"):
+        _local.markdown = markdown.Markdown()
+    return _local.markdown
+
+
+def _cleaner():
+    if not hasattr(_local, "cleaner"):
+        _local.cleaner = bleach.Cleaner(
+            tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES
+        )
+    return _local.cleaner
+
+
+def _input_cleaner():
+    if not hasattr(_local, "input_cleaner"):
+        _local.input_cleaner = bleach.Cleaner()
+    return _local.input_cleaner
+
+
+def _render(text):
+    return _cleaner().clean(_markdown().reset().convert(text))
+
+
+def render_markdown(text):
+    return render_cache.get_or_render("markdown", text or "", _render)
+
+
+def sanitize(text):
+    return render_cache.get_or_render(
+        "sanitize", text, lambda value: _input_cleaner().clean(value)
+    )
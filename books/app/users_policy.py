@@ -1,26 +1,48 @@
-from flask_login import current_user
+# Действия политики; порядок задаёт номера битов в матрице прав
+ACTIONS = (
+    "create",
+    "read",
+    "update",
+    "delete",
+    "assign_role",
+    "write_review",
+    "delete_review",
+)
+
 
 class UsersPolicy:
-    def __init__(self, user):
-        self.user = user
+    # Права роли role_id (None — анонимный посетитель). Вызывается только
+    # при построении матрицы прав, проверки в запросах идут по ней.
+    def __init__(self, role_id, config):
+        self.role_id = role_id
+        self.config = config
+
+    def is_admin(self):
+        return self.role_id == self.config["ADMIN_ROLE_ID"]
+
+    def is_moder(self):
+        return self.role_id == self.config["MODER_ROLE_ID"]
+
+    def is_authenticated(self):
+        return self.role_id is not None
 
     def create(self):
-        return current_user.is_admin()
+        return self.is_admin()
 
     def read(self):
         return True
 
     def update(self):
-        return current_user.is_admin() or current_user.is_moder()
+        return self.is_admin() or self.is_moder()
 
     def delete(self):
-        return current_user.is_admin()
+        return self.is_admin()
 
     def assign_role(self):
-        return current_user.is_admin()
+        return self.is_admin()
 
     def write_review(self):
-        return current_user.is_authenticated
-    
+        return self.is_authenticated()
+
     def delete_review(self):
-        return current_user.is_admin() or current_user.is_moder()
+        return self.is_admin() or self.is_moder()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули приложения импортируются как верхнеуровневые, как при запуске из books/app
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "app"))
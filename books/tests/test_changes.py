@@ -0,0 +1,191 @@
+import pytest
+from flask import Flask
+
+import changes
+from changes import STARTUP_WINDOW, ChangeLog, CatalogChanges
+
+
+class FakeCursor:
+    # Отвечает на запросы ChangeLog по списку видимых (зафиксированных)
+    # строк журнала [(version, kind, book_id, changed_at)]
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def execute(self, sql, params=()):
+        rows = sorted(self.rows)
+        if "GROUP BY" in sql:
+            folded = {}
+            for version, _, book_id, changed_at in rows:
+                if version <= params[0]:
+                    folded[book_id] = (book_id, version, changed_at)
+            self.result = list(folded.values())
+        elif "DESC" in sql:
+            self.result = rows[::-1][: params[0]]
+        else:
+            self.result = [row for row in rows if row[0] > params[0]][:1000]
+
+    def fetchall(self):
+        return self.result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(changes.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def rows():
+    return []
+
+
+def poll(log, rows):
+    return [change[0] for change in log.poll(FakeCursor(rows))]
+
+
+def test_changes_apply_in_order(clock, rows):
+    log = ChangeLog(gap_timeout=10)
+    assert poll(log, rows) == []
+    rows += [
+        (1, changes.BOOK, 5, 100),
+        (2, changes.BOOK, 6, 200),
+        (3, changes.GENRES, None, 300),
+    ]
+    assert poll(log, rows) == [1, 2, 3]
+    assert log.version == 3
+    assert log.book_version(5) == 3
+    assert log.book_version(7) == 3
+    assert log.book_modified(6) == 300.0
+    assert log.catalog_version == 3
+
+
+def test_late_commit_with_lower_version(clock, rows):
+    log = ChangeLog(gap_timeout=10)
+    poll(log, rows)
+    # Версия 1 выдана раньше, но зафиксирована после версии 2
+    rows.append((2, changes.BOOK, 6, 200))
+    assert poll(log, rows) == []
+    assert log.book_version(6) == 0
+    rows.append((1, changes.BOOK, 5, 100))
+    assert poll(log, rows) == [1, 2]
+    assert log.book_version(5) == 1
+    assert log.book_version(6) == 2
+    assert log.catalog_version == 2
+
+
+def test_gap_times_out(clock, rows):
+    log = ChangeLog(gap_timeout=10)
+    poll(log, rows)
+    rows.append((2, changes.BOOK, 6, 200))
+    assert poll(log, rows) == []
+    clock.now += 10
+    assert poll(log, rows) == []
+    clock.now += 1
+    # Транзакция с версией 1 откатилась: изменение 2 применяется без неё
+    assert poll(log, rows) == [2]
+    assert log.version == 2
+    # Опрос читает журнал после применённой версии
+    rows.append((1, changes.BOOK, 5, 100))
+    assert poll(log, rows) == []
+
+
+def test_startup_window_and_folded_history(clock, rows):
+    rows += [(version, changes.BOOK, version % 3, version) for version in range(1, 301)]
+    log = ChangeLog(gap_timeout=10)
+    applied = poll(log, rows)
+    # Последние STARTUP_WINDOW изменений проходят обычный путь,
+    # более ранние свёрнуты до последнего по каждой книге
+    assert applied == list(range(301 - STARTUP_WINDOW, 301))
+    assert log.version == 300
+    assert {book_id: log.book_version(book_id) for book_id in range(3)} == {
+        0: 300,
+        1: 298,
+        2: 299,
+    }
+
+
+def test_startup_window_waits_for_gap(clock, rows):
+    rows += [(1, changes.BOOK, 5, 100), (3, changes.BOOK, 6, 300)]
+    log = ChangeLog(gap_timeout=10)
+    assert poll(log, rows) == [1]
+    rows.append((2, changes.BOOK, 7, 200))
+    assert poll(log, rows) == [2, 3]
+
+
+class FakeConnector:
+    def __init__(self, rows):
+        self.rows = rows
+        self.server = "primary"
+
+    def target(self):
+        return self.server
+
+    def connect(self):
+        return self
+
+    @property
+    def raw(self):
+        return self
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+@pytest.fixture
+def catalog_changes(clock, rows):
+    app = Flask(__name__)
+    catalog_changes = CatalogChanges(FakeConnector(rows))
+    catalog_changes.init_app(app)
+    with app.app_context():
+        yield catalog_changes
+
+
+def test_listener_fires_once_per_change(catalog_changes, rows):
+    calls = []
+    catalog_changes.listen(changes.ROLES, calls.append)
+    catalog_changes.listen(changes.ROLES, calls.append)
+    catalog_changes.poll()
+    rows += [(1, changes.ROLES, None, 100), (2, changes.BOOK, 5, 200)]
+    catalog_changes.poll()
+    catalog_changes.poll()
+    catalog_changes.db_connector.server = 0
+    catalog_changes.poll()
+    assert calls == [[(1, changes.ROLES, None, 100)]]
+
+
+def test_each_server_listener(catalog_changes, rows):
+    calls = []
+    catalog_changes.listen(
+        changes.BOOK, lambda applied: calls.append((server(), applied)), each_server=True
+    )
+    server = catalog_changes.db_connector.target
+    rows.append((1, changes.BOOK, 5, 100))
+    # Изменения из окна загрузки были видны до старта процесса
+    catalog_changes.poll()
+    assert calls == []
+    rows.append((2, changes.BOOK, 6, 200))
+    catalog_changes.poll()
+    catalog_changes.db_connector.server = 0
+    catalog_changes.poll()
+    rows.append((3, changes.BOOK, 7, 300))
+    catalog_changes.poll()
+    assert calls == [
+        ("primary", [(2, changes.BOOK, 6, 200)]),
+        (0, [(3, changes.BOOK, 7, 300)]),
+    ]
@@ -0,0 +1,112 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import Flask, flash, get_flashed_messages
+from flask_login import LoginManager
+
+import app as books
+import changes
+from http_cache import HttpCache
+
+
+class PurgeProxy(ThreadingHTTPServer):
+    # Заменитель обратного прокси: запоминает ключи из запросов PURGE
+    def __init__(self, status=200):
+        super().__init__(("127.0.0.1", 0), PurgeHandler)
+        self.status = status
+        self.purged = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+
+class PurgeHandler(BaseHTTPRequestHandler):
+    def do_PURGE(self):
+        self.server.purged.append(self.headers["Surrogate-Key"])
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def proxy(request):
+    server = PurgeProxy(getattr(request, "param", 200))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def books_app(proxy):
+    app = books.create_app({"SURROGATE_PURGE_URL": proxy.url})
+    with app.app_context():
+        yield app
+
+
+def test_book_change_purges_catalog_and_book(books_app, proxy):
+    books.purge_changed([(5, changes.BOOK, 7, 0), (6, changes.REVIEW, 7, 0)])
+    assert proxy.purged == ["catalog book-7"]
+
+
+def test_catalog_change_purges_all_books(books_app, proxy):
+    books.purge_changed([(5, changes.GENRES, None, 0), (6, changes.BOOK, 3, 0)])
+    assert proxy.purged == ["catalog book-3 books"]
+
+
+@pytest.mark.parametrize("proxy", [500], indirect=True)
+def test_failed_purge_does_not_fail_request(books_app, proxy, caplog):
+    books.purge_changed([(5, changes.BOOK, 7, 0)])
+    assert proxy.purged == ["catalog book-7"]
+    assert "Не удалось очистить кэш" in caplog.text
+
+
+def test_unreachable_proxy_does_not_fail_request(books_app, proxy, caplog):
+    proxy.shutdown()
+    proxy.server_close()
+    books.purge_changed([(5, changes.BOOK, 7, 0)])
+    assert "Не удалось очистить кэш" in caplog.text
+
+
+@pytest.fixture
+def page_app():
+    app = Flask(__name__)
+    app.secret_key = "test"
+    LoginManager(app).user_loader(lambda user_id: None)
+    http_cache = HttpCache()
+    http_cache.init_app(app)
+
+    @app.route("/")
+    @http_cache.policy(lambda: ["catalog"])
+    def index():
+        return " ".join(get_flashed_messages()) or "каталог"
+
+    @app.route("/flash", methods=["POST"])
+    def add_flash():
+        flash("Книга добавлена")
+        return "ok"
+
+    return app
+
+
+def test_anonymous_page_is_public(page_app):
+    response = page_app.test_client().get("/")
+    assert response.headers["Cache-Control"].startswith("public")
+    assert response.headers["Surrogate-Key"] == "catalog"
+    assert "Set-Cookie" not in response.headers
+
+
+def test_page_with_pending_flash_is_private(page_app):
+    client = page_app.test_client()
+    client.post("/flash")
+    response = client.get("/")
+    assert response.get_data(as_text=True) == "Книга добавлена"
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert "Surrogate-Key" not in response.headers
+    assert client.get("/").headers["Cache-Control"].startswith("public")
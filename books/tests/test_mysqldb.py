@@ -0,0 +1,207 @@
+import logging
+from collections import namedtuple
+
+import mysql.connector
+import pytest
+from flask import Flask
+
+import app as books
+from mysqldb import DBConnector, InstrumentedCursor, QueryStats
+from rendering import RenderCache
+
+
+Count = namedtuple("Count", "count")
+
+
+class FakeCursor:
+    # Строки ответа — из responses по началу текста запроса, иначе пусто;
+    # тексты выполненных запросов копятся в executed
+    def __init__(self, executed, responses=None):
+        self.executed = executed
+        self.responses = responses or {}
+        self.rows = []
+        self.with_rows = False
+        self.column_names = ()
+        self.rowcount = 0
+
+    def execute(self, operation, params=()):
+        self.executed.append(operation)
+        statement = " ".join(operation.split())
+        self.rows = []
+        for start, rows in self.responses.items():
+            if statement.startswith(start):
+                self.rows = list(rows)
+        self.with_rows = statement.upper().startswith(("SELECT", "SHOW"))
+
+    def executemany(self, operation, seq_params):
+        self.executed.append(operation)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def nextset(self):
+        return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeConnection:
+    in_transaction = False
+
+    def __init__(self, executed, responses):
+        self.executed = executed
+        self.responses = responses
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.executed, self.responses)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def responses():
+    return {}
+
+
+@pytest.fixture
+def executed(monkeypatch, responses):
+    executed = []
+    monkeypatch.setattr(
+        mysql.connector, "connect", lambda **config: FakeConnection(executed, responses)
+    )
+    return executed
+
+
+def test_query_stats_counts_statements():
+    stats = QueryStats()
+    stats.record("SELECT *\n  FROM books WHERE book_id = %s", 0.002)
+    stats.record("SELECT * FROM books WHERE book_id = %s", 0.001)
+    stats.record("SELECT COUNT(*) FROM books", 0.004)
+    assert stats.count == 3
+    assert stats.duration == pytest.approx(0.007)
+    assert stats.statements["SELECT * FROM books WHERE book_id = %s"] == 2
+    assert stats.slowest == (0.004, "SELECT COUNT(*) FROM books")
+    assert stats.repeated(2) == [("SELECT * FROM books WHERE book_id = %s", 2)]
+    assert stats.server_timing() == 'db;dur=7.0;desc="3 queries, 0 retries"'
+
+
+def test_instrumented_cursor_records_each_execution():
+    stats = QueryStats()
+    cursor = InstrumentedCursor(FakeCursor([]), stats)
+    cursor.execute("SELECT 1")
+    cursor.executemany("INSERT INTO genres (genre_name) VALUES (%s)", [("a",), ("b",)])
+    assert cursor.fetchall() == []
+    assert stats.count == 2
+    assert list(stats.statements) == [
+        "SELECT 1",
+        "INSERT INTO genres (genre_name) VALUES (%s)",
+    ]
+
+
+def test_failed_execution_is_recorded():
+    class FailingCursor(FakeCursor):
+        def execute(self, operation, params=()):
+            raise mysql.connector.errors.OperationalError("нет соединения")
+
+    stats = QueryStats()
+    with pytest.raises(mysql.connector.errors.OperationalError):
+        InstrumentedCursor(FailingCursor([]), stats).execute("SELECT 1")
+    assert stats.count == 1
+
+
+@pytest.fixture
+def lookup_app(executed):
+    app = Flask(__name__)
+    app.config.update(
+        MYSQL_USER="books",
+        MYSQL_PASSWORD="",
+        MYSQL_HOST="localhost",
+        MYSQL_DATABASE="books",
+        N_PLUS_ONE_THRESHOLD=3,
+    )
+    db_connector = DBConnector(app)
+    statement = db_connector.statement(
+        "genre_by_id", "SELECT genre_name FROM genres WHERE genre_id = %s"
+    )
+
+    @app.route("/<int:count>")
+    def lookups(count):
+        for genre_id in range(count):
+            db_connector.query(statement, (genre_id,))
+        return "ok"
+
+    app.db_connector = db_connector
+    return app
+
+
+def test_report_logs_summary_and_server_timing(lookup_app, caplog):
+    with caplog.at_level(logging.INFO):
+        response = lookup_app.test_client().get("/2")
+    assert response.headers["Server-Timing"].endswith('desc="2 queries, 0 retries"')
+    assert "GET /2: 2 SQL-запросов" in caplog.text
+    assert "самый долгий" in caplog.text
+    assert "Возможный N+1" not in caplog.text
+
+
+def test_report_appends_summaries(lookup_app, caplog):
+    render_cache = RenderCache()
+    render_cache.get_or_render("description", "*текст*", str.upper)
+    render_cache.get_or_render("description", "*текст*", str.upper)
+    lookup_app.db_connector.add_summary(render_cache.summary)
+    lookup_app.db_connector.add_summary(render_cache.summary)
+    with caplog.at_level(logging.INFO):
+        lookup_app.test_client().get("/1")
+    assert caplog.text.count("; кэш markdown 1 попаданий, 1 промахов, 1 записей") == 1
+
+
+def test_repeated_statement_warns_n_plus_one(lookup_app, caplog):
+    lookup_app.test_client().get("/3")
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert warnings == [
+        "Возможный N+1 на /3: запрос выполнен 3 раз: "
+        "SELECT genre_name FROM genres WHERE genre_id = %s"
+    ]
+
+
+def test_assert_max_queries_fails_with_statements(lookup_app):
+    client = lookup_app.test_client()
+    with lookup_app.db_connector.assert_max_queries(3):
+        client.get("/3")
+    with pytest.raises(AssertionError) as error:
+        with lookup_app.db_connector.assert_max_queries(3):
+            client.get("/2")
+            client.get("/2")
+    message = str(error.value)
+    assert "Выполнено 4 SQL-запросов, допустимо не более 3" in message
+    assert "4 x SELECT genre_name FROM genres WHERE genre_id = %s" in message
+
+
+def test_catalog_page_query_budget(executed, responses, tmp_path):
+    responses["SELECT COUNT(*) AS count FROM books"] = [Count(0)]
+    app = books.create_app({"TESTING": True, "CACHE_DIR": str(tmp_path)})
+    client = app.test_client()
+    # Список книг и число книг; опрос журнала изменений не считается
+    with books.db_connector.assert_max_queries(2):
+        assert client.get("/").status_code == 200
+    assert any("catalog_changes" in operation for operation in executed)
@@ -0,0 +1,33 @@
+import pytest
+
+from passwords import Passwords, Sha256Hasher, WerkzeugHasher
+
+
+@pytest.fixture
+def hashing(monkeypatch):
+    hashing = Passwords(WerkzeugHasher("pbkdf2:sha256:1000"), Sha256Hasher())
+    hashing.dummy_calls = []
+    monkeypatch.setattr(hashing, "dummy_verify", hashing.dummy_calls.append)
+    return hashing
+
+
+def test_wrong_legacy_password_pays_primary_hasher(hashing):
+    assert hashing.verify("неверный", Sha256Hasher().hash("секрет")) == (False, False)
+    assert hashing.dummy_calls == ["неверный"]
+
+
+def test_unknown_format_pays_primary_hasher(hashing):
+    assert hashing.verify("секрет", "не хэш") == (False, False)
+    assert hashing.dummy_calls == ["секрет"]
+
+
+def test_legacy_password_is_rehashed(hashing):
+    assert hashing.verify("секрет", Sha256Hasher().hash("секрет")) == (True, True)
+    assert hashing.dummy_calls == []
+
+
+def test_wrong_primary_password_is_checked_once(hashing):
+    encoded = hashing.hash("секрет")
+    assert hashing.verify("неверный", encoded) == (False, False)
+    assert hashing.verify("секрет", encoded) == (True, False)
+    assert hashing.dummy_calls == []
@@ -15,6 +15,29 @@
 /*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
 /*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
 
+--
+-- Table structure for table `book_stats`
+--
+
+DROP TABLE IF EXISTS `book_stats`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `book_stats` (
+  `book_id` int(11) NOT NULL,
+  `review_count` int(11) NOT NULL DEFAULT '0',
+  `rating_sum` int(11) NOT NULL DEFAULT '0',
+  `avg_rating` decimal(3,2) GENERATED ALWAYS AS (if((`review_count` > 0),(`rating_sum` / `review_count`),NULL)) STORED,
+  `rating_0` int(11) NOT NULL DEFAULT '0',
+  `rating_1` int(11) NOT NULL DEFAULT '0',
+  `rating_2` int(11) NOT NULL DEFAULT '0',
+  `rating_3` int(11) NOT NULL DEFAULT '0',
+  `rating_4` int(11) NOT NULL DEFAULT '0',
+  `rating_5` int(11) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`book_id`),
+  CONSTRAINT `book_stats_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `books`
 --
@@ -31,8 +54,11 @@ CREATE TABLE `books` (
   `author` varchar(100) NOT NULL,
   `volume_pages` int(11) NOT NULL,
   `cover_id` int(11) DEFAULT NULL,
+  `book_description_html` mediumtext,
+  `render_version` smallint(6) NOT NULL DEFAULT '0',
   PRIMARY KEY (`book_id`),
   KEY `books_ibfk_1` (`cover_id`),
+  KEY `books_year_id` (`year`,`book_id`),
   CONSTRAINT `books_ibfk_1` FOREIGN KEY (`cover_id`) REFERENCES `covers` (`cover_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=14 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -56,6 +82,23 @@ CREATE TABLE `books_genres` (
 ) ENGINE=InnoDB AUTO_INCREMENT=113 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `catalog_changes`
+--
+
+DROP TABLE IF EXISTS `catalog_changes`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `catalog_changes` (
+  `version` bigint(20) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `book_id` int(11) DEFAULT NULL,
+  `changed_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`),
+  KEY `catalog_changes_book` (`book_id`,`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `covers`
 --
@@ -101,7 +144,8 @@ CREATE TABLE `reviews` (
   `text` text NOT NULL,
   `date` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`review_id`),
-  KEY `book_id` (`book_id`),
+  KEY `reviews_book_date` (`book_id`,`date`,`review_id`),
+  KEY `reviews_book_user` (`book_id`,`user_id`),
   CONSTRAINT `reviews_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=21 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -137,10 +181,53 @@ CREATE TABLE `users` (
   `last_name` varchar(100) NOT NULL,
   `role_id` int(11) NOT NULL,
   PRIMARY KEY (`user_id`),
+  UNIQUE KEY `users_login` (`login`),
   KEY `users_ibfk_1` (`role_id`),
   CONSTRAINT `users_ibfk_1` FOREIGN KEY (`role_id`) REFERENCES `roles` (`role_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping routines for database 'std_2390_books'
+--
+/*!50003 DROP PROCEDURE IF EXISTS `book_view` */;
+/*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+/*!50003 SET @saved_cs_results     = @@character_set_results */ ;
+/*!50003 SET @saved_col_connection = @@collation_connection */ ;
+/*!50003 SET character_set_client  = utf8mb4 */ ;
+/*!50003 SET character_set_results = utf8mb4 */ ;
+/*!50003 SET collation_connection  = utf8mb4_general_ci */ ;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+/*!50003 SET sql_mode              = 'ONLY_FULL_GROUP_BY,STRICT_TRANS_TABLES,NO_ZERO_IN_DATE,NO_ZERO_DATE,ERROR_FOR_DIVISION_BY_ZERO,NO_AUTO_CREATE_USER,NO_ENGINE_SUBSTITUTION' */ ;
+DELIMITER ;;
+CREATE PROCEDURE `book_view`(IN p_book_id INT, IN p_user_id INT, IN p_reviews INT)
+BEGIN
+  SELECT b.book_id, b.book_name, b.book_description, b.book_description_html, b.render_version, b.year, b.publishing_house, b.author, b.volume_pages, b.cover_id,
+         GROUP_CONCAT(g.genre_name ORDER BY g.genre_name SEPARATOR ', ') AS genres,
+         s.avg_rating, s.review_count
+  FROM books b
+  LEFT JOIN book_stats s ON b.book_id = s.book_id
+  LEFT JOIN books_genres bg ON b.book_id = bg.book_id
+  LEFT JOIN genres g ON bg.genre_id = g.genre_id
+  WHERE b.book_id = p_book_id
+  GROUP BY b.book_id, s.avg_rating, s.review_count;
+
+  SELECT r.review_id, r.rating, r.text, r.user_id, r.date, u.login AS username
+  FROM reviews r
+  JOIN users u ON r.user_id = u.user_id
+  WHERE r.book_id = p_book_id
+  ORDER BY r.date DESC, r.review_id DESC
+  LIMIT p_reviews;
+
+  SELECT review_id, rating, text, user_id FROM reviews
+  WHERE book_id = p_book_id AND user_id = p_user_id
+  LIMIT 1;
+END ;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+/*!50003 SET character_set_client  = @saved_cs_client */ ;
+/*!50003 SET character_set_results = @saved_cs_results */ ;
+/*!50003 SET collation_connection  = @saved_col_connection */ ;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
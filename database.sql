@@ -15,6 +15,39 @@
 /*!40101 SET @OLD_SQL_MODE=@@SQL_MODE, SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;
 /*!40111 SET @OLD_SQL_NOTES=@@SQL_NOTES, SQL_NOTES=0 */;
 
+--
+-- Table structure for table `book_stats`
+--
+
+DROP TABLE IF EXISTS `book_stats`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `book_stats` (
+  `book_id` int(11) NOT NULL,
+  `review_count` int(11) NOT NULL DEFAULT '0',
+  `rating_sum` int(11) NOT NULL DEFAULT '0',
+  `avg_rating` decimal(3,2) GENERATED ALWAYS AS (if((`review_count` > 0),(`rating_sum` / `review_count`),NULL)) STORED,
+  `rating_0` int(11) NOT NULL DEFAULT '0',
+  `rating_1` int(11) NOT NULL DEFAULT '0',
+  `rating_2` int(11) NOT NULL DEFAULT '0',
+  `rating_3` int(11) NOT NULL DEFAULT '0',
+  `rating_4` int(11) NOT NULL DEFAULT '0',
+  `rating_5` int(11) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`book_id`),
+  CONSTRAINT `book_stats_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `book_stats`
+--
+
+LOCK TABLES `book_stats` WRITE;
+/*!40000 ALTER TABLE `book_stats` DISABLE KEYS */;
+INSERT INTO `book_stats` (`book_id`, `review_count`, `rating_sum`, `rating_0`, `rating_1`, `rating_2`, `rating_3`, `rating_4`, `rating_5`) VALUES (1,1,5,0,0,0,0,0,1),(3,0,0,0,0,0,0,0,0),(10,2,9,0,0,0,0,1,1),(13,1,5,0,0,0,0,0,1);
+/*!40000 ALTER TABLE `book_stats` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `books`
 --
@@ -31,8 +64,11 @@ CREATE TABLE `books` (
   `author` varchar(100) NOT NULL,
   `volume_pages` int(11) NOT NULL,
   `cover_id` int(11) DEFAULT NULL,
+  `book_description_html` mediumtext,
+  `render_version` smallint(6) NOT NULL DEFAULT '0',
   PRIMARY KEY (`book_id`),
   KEY `books_ibfk_1` (`cover_id`),
+  KEY `books_year_id` (`year`,`book_id`),
   CONSTRAINT `books_ibfk_1` FOREIGN KEY (`cover_id`) REFERENCES `covers` (`cover_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=14 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -43,7 +79,7 @@ CREATE TABLE `books` (
 
 LOCK TABLES `books` WRITE;
 /*!40000 ALTER TABLE `books` DISABLE KEYS */;
-INSERT INTO `books` VALUES (1,'451 градус по Фаренгейту','Роман описывает американское общество близкого будущего, в котором книги находятся под запретом; «пожарные», к числу которых принадлежит и главный герой Гай Монтэг, сжигают любые найденные книги. В ходе романа Монтэг разочаровывается в идеалах общества, частью которого он является, становится изгоем и присоединяется к небольшой подпольной группе маргиналов, сторонники которой заучивают тексты книг, чтобы спасти их для потомков. Название книги объясняется в эпиграфе: «451 градус по Фаренгейту — температура, при которой воспламеняется и горит бумага». В книге содержится немало цитат из произведений англоязычных авторов прошлого (таких, как Уильям Шекспир, Джонатан Свифт и другие), а также несколько цитат из Библии.',1953,'Ballantine Books','Рэя Брэдбери',200,1),(3,'Капитанская дочка','Действие произведения происходит в период восстания Емельяна Пугачева и основано на реальных событиях. Повесть написана в форме мемуаров главного героя Петра Андреича Гринева – его дневниковых записей. Произведение названо в честь возлюбленной Гринева – Марьи Мироновой, капитанской дочери.',1936,'«Современник»','Александр Сергеевич Пушкин',256,1),(10,'123','# 2123',2123,'123','123',123,1),(13,'пойдет','            *norm*\r\n        ',2024,'политех','раиль',1000,1);
+INSERT INTO `books` VALUES (1,'451 градус по Фаренгейту','Роман описывает американское общество близкого будущего, в котором книги находятся под запретом; «пожарные», к числу которых принадлежит и главный герой Гай Монтэг, сжигают любые найденные книги. В ходе романа Монтэг разочаровывается в идеалах общества, частью которого он является, становится изгоем и присоединяется к небольшой подпольной группе маргиналов, сторонники которой заучивают тексты книг, чтобы спасти их для потомков. Название книги объясняется в эпиграфе: «451 градус по Фаренгейту — температура, при которой воспламеняется и горит бумага». В книге содержится немало цитат из произведений англоязычных авторов прошлого (таких, как Уильям Шекспир, Джонатан Свифт и другие), а также несколько цитат из Библии.',1953,'Ballantine Books','Рэя Брэдбери',200,1,NULL,0),(3,'Капитанская дочка','Действие произведения происходит в период восстания Емельяна Пугачева и основано на реальных событиях. Повесть написана в форме мемуаров главного героя Петра Андреича Гринева – его дневниковых записей. Произведение названо в честь возлюбленной Гринева – Марьи Мироновой, капитанской дочери.',1936,'«Современник»','Александр Сергеевич Пушкин',256,1,NULL,0),(10,'123','# 2123',2123,'123','123',123,1,NULL,0),(13,'пойдет','            *norm*\r\n        ',2024,'политех','раиль',1000,1,NULL,0);
 /*!40000 ALTER TABLE `books` ENABLE KEYS */;
 UNLOCK TABLES;
 
@@ -76,6 +112,32 @@ INSERT INTO `books_genres` VALUES (22,3,2),(23,3,6),(27,1,1),(28,1,3),(107,10,1)
 /*!40000 ALTER TABLE `books_genres` ENABLE KEYS */;
 UNLOCK TABLES;
 
+--
+-- Table structure for table `catalog_changes`
+--
+
+DROP TABLE IF EXISTS `catalog_changes`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `catalog_changes` (
+  `version` bigint(20) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `book_id` int(11) DEFAULT NULL,
+  `changed_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`),
+  KEY `catalog_changes_book` (`book_id`,`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Dumping data for table `catalog_changes`
+--
+
+LOCK TABLES `catalog_changes` WRITE;
+/*!40000 ALTER TABLE `catalog_changes` DISABLE KEYS */;
+/*!40000 ALTER TABLE `catalog_changes` ENABLE KEYS */;
+UNLOCK TABLES;
+
 --
 -- Table structure for table `covers`
 --
@@ -141,7 +203,8 @@ CREATE TABLE `reviews` (
   `text` text NOT NULL,
   `date` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`review_id`),
-  KEY `book_id` (`book_id`),
+  KEY `reviews_book_date` (`book_id`,`date`,`review_id`),
+  KEY `reviews_book_user` (`book_id`,`user_id`),
   CONSTRAINT `reviews_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=21 DEFAULT CHARSET=utf8;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -197,6 +260,7 @@ CREATE TABLE `users` (
   `last_name` varchar(100) NOT NULL,
   `role_id` int(11) NOT NULL,
   PRIMARY KEY (`user_id`),
+  UNIQUE KEY `users_login` (`login`),
   KEY `users_ibfk_1` (`role_id`),
   CONSTRAINT `users_ibfk_1` FOREIGN KEY (`role_id`) REFERENCES `roles` (`role_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=4 DEFAULT CHARSET=utf8;
@@ -211,6 +275,48 @@ LOCK TABLES `users` WRITE;
 INSERT INTO `users` VALUES (1,'Admin','0a8ab892fd7df1a92a41c2599108fc7857e1db1fc3602533538a1b177c2e182e','Шакиров','Раиль','Линарович',1),(2,'Moder','0a8ab892fd7df1a92a41c2599108fc7857e1db1fc3602533538a1b177c2e182e','Shakirov','Rail','Linarovich',2),(3,'User','0a8ab892fd7df1a92a41c2599108fc7857e1db1fc3602533538a1b177c2e182e','Силантьев','Даниил','Андреевич',3);
 /*!40000 ALTER TABLE `users` ENABLE KEYS */;
 UNLOCK TABLES;
+
+--
+-- Dumping routines for database 'std_2390_books'
+--
+/*!50003 DROP PROCEDURE IF EXISTS `book_view` */;
+/*!50003 SET @saved_cs_client      = @@character_set_client */ ;
+/*!50003 SET @saved_cs_results     = @@character_set_results */ ;
+/*!50003 SET @saved_col_connection = @@collation_connection */ ;
+/*!50003 SET character_set_client  = utf8mb4 */ ;
+/*!50003 SET character_set_results = utf8mb4 */ ;
+/*!50003 SET collation_connection  = utf8mb4_general_ci */ ;
+/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;
+/*!50003 SET sql_mode              = 'ONLY_FULL_GROUP_BY,STRICT_TRANS_TABLES,NO_ZERO_IN_DATE,NO_ZERO_DATE,ERROR_FOR_DIVISION_BY_ZERO,NO_AUTO_CREATE_USER,NO_ENGINE_SUBSTITUTION' */ ;
+DELIMITER ;;
+CREATE PROCEDURE `book_view`(IN p_book_id INT, IN p_user_id INT, IN p_reviews INT)
+BEGIN
+  SELECT b.book_id, b.book_name, b.book_description, b.book_description_html, b.render_version, b.year, b.publishing_house, b.author, b.volume_pages, b.cover_id,
+         GROUP_CONCAT(g.genre_name ORDER BY g.genre_name SEPARATOR ', ') AS genres,
+         s.avg_rating, s.review_count
+  FROM books b
+  LEFT JOIN book_stats s ON b.book_id = s.book_id
+  LEFT JOIN books_genres bg ON b.book_id = bg.book_id
+  LEFT JOIN genres g ON bg.genre_id = g.genre_id
+  WHERE b.book_id = p_book_id
+  GROUP BY b.book_id, s.avg_rating, s.review_count;
+
+  SELECT r.review_id, r.rating, r.text, r.user_id, r.date, u.login AS username
+  FROM reviews r
+  JOIN users u ON r.user_id = u.user_id
+  WHERE r.book_id = p_book_id
+  ORDER BY r.date DESC, r.review_id DESC
+  LIMIT p_reviews;
+
+  SELECT review_id, rating, text, user_id FROM reviews
+  WHERE book_id = p_book_id AND user_id = p_user_id
+  LIMIT 1;
+END ;;
+DELIMITER ;
+/*!50003 SET sql_mode              = @saved_sql_mode */ ;
+/*!50003 SET character_set_client  = @saved_cs_client */ ;
+/*!50003 SET character_set_results = @saved_cs_results */ ;
+/*!50003 SET collation_connection  = @saved_col_connection */ ;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
@@ -0,0 +1,2 @@
+-- Составной индекс для постраничного вывода по ключу (year, book_id)
+ALTER TABLE `books` ADD KEY `books_year_id` (`year`,`book_id`);
@@ -0,0 +1,16 @@
+-- Денормализованная статистика рецензий; после применения выполнить
+-- flask books backfill-stats
+CREATE TABLE `book_stats` (
+  `book_id` int(11) NOT NULL,
+  `review_count` int(11) NOT NULL DEFAULT '0',
+  `rating_sum` int(11) NOT NULL DEFAULT '0',
+  `avg_rating` decimal(3,2) GENERATED ALWAYS AS (if((`review_count` > 0),(`rating_sum` / `review_count`),NULL)) STORED,
+  `rating_0` int(11) NOT NULL DEFAULT '0',
+  `rating_1` int(11) NOT NULL DEFAULT '0',
+  `rating_2` int(11) NOT NULL DEFAULT '0',
+  `rating_3` int(11) NOT NULL DEFAULT '0',
+  `rating_4` int(11) NOT NULL DEFAULT '0',
+  `rating_5` int(11) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`book_id`),
+  CONSTRAINT `book_stats_ibfk_1` FOREIGN KEY (`book_id`) REFERENCES `books` (`book_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
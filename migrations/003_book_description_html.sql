@@ -0,0 +1,5 @@
+-- Отрисованный HTML описания хранится рядом с исходным markdown; после
+-- применения выполнить flask books rerender-descriptions
+ALTER TABLE `books`
+  ADD COLUMN `book_description_html` mediumtext AFTER `cover_id`,
+  ADD COLUMN `render_version` smallint(6) NOT NULL DEFAULT '0' AFTER `book_description_html`;
@@ -0,0 +1,6 @@
+-- Постраничный вывод рецензий по ключу (book_id, date, review_id) и поиск
+-- рецензии текущего пользователя; оба индекса покрывают внешний ключ по book_id
+ALTER TABLE `reviews`
+  ADD KEY `reviews_book_date` (`book_id`,`date`,`review_id`),
+  ADD KEY `reviews_book_user` (`book_id`,`user_id`),
+  DROP KEY `book_id`;
@@ -0,0 +1,28 @@
+-- Страница книги за одно обращение к серверу: книга с жанрами и статистикой,
+-- первая страница рецензий и рецензия текущего пользователя (p_user_id может быть NULL)
+DROP PROCEDURE IF EXISTS `book_view`;
+DELIMITER ;;
+CREATE PROCEDURE `book_view`(IN p_book_id INT, IN p_user_id INT, IN p_reviews INT)
+BEGIN
+  SELECT b.book_id, b.book_name, b.book_description, b.book_description_html, b.render_version, b.year, b.publishing_house, b.author, b.volume_pages, b.cover_id,
+         GROUP_CONCAT(g.genre_name ORDER BY g.genre_name SEPARATOR ', ') AS genres,
+         s.avg_rating, s.review_count
+  FROM books b
+  LEFT JOIN book_stats s ON b.book_id = s.book_id
+  LEFT JOIN books_genres bg ON b.book_id = bg.book_id
+  LEFT JOIN genres g ON bg.genre_id = g.genre_id
+  WHERE b.book_id = p_book_id
+  GROUP BY b.book_id, s.avg_rating, s.review_count;
+
+  SELECT r.review_id, r.rating, r.text, r.user_id, r.date, u.login AS username
+  FROM reviews r
+  JOIN users u ON r.user_id = u.user_id
+  WHERE r.book_id = p_book_id
+  ORDER BY r.date DESC, r.review_id DESC
+  LIMIT p_reviews;
+
+  SELECT review_id, rating, text, user_id FROM reviews
+  WHERE book_id = p_book_id AND user_id = p_user_id
+  LIMIT 1;
+END ;;
+DELIMITER ;
@@ -0,0 +1,11 @@
+-- Журнал изменений каталога: строка пишется в одной транзакции с изменением
+-- книги, её жанров или рецензий (book_id NULL — изменение всего каталога).
+-- Воркеры опрашивают журнал и сбрасывают кэши только изменившихся книг.
+CREATE TABLE `catalog_changes` (
+  `version` bigint(20) NOT NULL AUTO_INCREMENT,
+  `kind` varchar(16) NOT NULL,
+  `book_id` int(11) DEFAULT NULL,
+  `changed_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`),
+  KEY `catalog_changes_book` (`book_id`,`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
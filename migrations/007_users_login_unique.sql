@@ -0,0 +1,5 @@
+-- Вход ищет пользователя только по логину, пароль проверяется в приложении.
+-- Перед применением убедиться, что повторяющихся логинов нет:
+--   SELECT login, COUNT(*) FROM users GROUP BY login HAVING COUNT(*) > 1;
+ALTER TABLE `users`
+  ADD UNIQUE KEY `users_login` (`login`);